@@ -1,70 +1,392 @@
-from collections import Counter
+import argparse
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import nltk
-from nltk.util import bigrams
+import numpy as np
 from nltk.corpus import stopwords
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import stage_trace
+
 # Download stopwords (if not already available)
 nltk.download("stopwords")
 
+def read_token_chunks(tokenized_file, start=0, end=None, chunk_size=1 << 20):
+    """Yields lists of tokens from the byte range [start, end) of a tokenized file.
+
+    `start` and `end` must fall on line boundaries. Empty lines are dropped.
+    """
+    with open(tokenized_file, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        tail = b""
+        while True:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = f.read(size) if size > 0 else b""
+            if remaining is not None:
+                remaining -= len(data)
+            with stage_trace.stage("read_tokens") as stage:
+                if not data:
+                    lines = [tail] if tail else []
+                else:
+                    data = tail + data
+                    cut = data.rfind(b"\n") + 1
+                    tail = data[cut:]
+                    lines = data[:cut].split(b"\n")[:-1]
+                tokens = [token for token in (line.decode("utf-8").strip() for line in lines) if token]
+                stage.items = len(tokens)
+            yield tokens
+            if not data:
+                break
+
+def shard_offsets(tokenized_file, num_shards):
+    """Splits a file into at most `num_shards` byte ranges that start and end on line boundaries."""
+    size = os.path.getsize(tokenized_file)
+    offsets = [0]
+    with open(tokenized_file, "rb") as f:
+        for i in range(1, num_shards):
+            f.seek(size * i // num_shards)
+            f.readline()
+            offset = f.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def count_shard(tokenized_file, start, end, stop_words, chunk_size):
+    """Counts one byte range of a tokenized file. Runs inside a worker process."""
+    counts = TokenCounts(stop_words)
+    for tokens in read_token_chunks(tokenized_file, start, end, chunk_size):
+        counts.update(tokens)
+    counts.compact()
+    return counts
+
+def pack_bigrams(first_ids, second_ids):
+    """Packs pairs of token IDs into single int64 bigram keys."""
+    return (first_ids << 32) | second_ids
+
+def unpack_bigrams(keys):
+    """Splits int64 bigram keys back into their two token IDs."""
+    return keys >> 32, keys & 0xFFFFFFFF
+
+def top_k(freqs, k=None, tiebreak=None):
+    """Returns the indices of the `k` largest counts, most frequent first.
+
+    Ties go to the smaller `tiebreak` value (the index itself by default),
+    matching the first-seen order of Counter.most_common(). Only the counts
+    at or above the k-th largest are sorted.
+    """
+    candidates = np.arange(len(freqs))
+    if k is not None and k < len(freqs):
+        threshold = np.partition(freqs, len(freqs) - k)[len(freqs) - k]
+        candidates = np.flatnonzero(freqs >= threshold)
+    order = candidates if tiebreak is None else tiebreak[candidates]
+    return candidates[np.lexsort((order, -freqs[candidates]))][:k]
+
+class TokenCounts:
+    """Running token, word, content-word and bigram counts for a contiguous part of a corpus.
+
+    Tokens are interned to integer IDs in first-seen order. Per-token counts and
+    word/content-word flags are NumPy arrays indexed by ID, and bigrams of
+    consecutive content words are kept as sorted packed int64 keys with their
+    counts and the position where each was first seen.
+    """
+
+    def __init__(self, stop_words):
+        self.stop_words = stop_words
+        self.vocab = []
+        self.token_ids = {}
+        self.token_freqs = np.zeros(0, dtype=np.int64)
+        self.is_word = np.zeros(0, dtype=bool)
+        self.is_content_word = np.zeros(0, dtype=bool)
+        self.bigram_keys = np.zeros(0, dtype=np.int64)
+        self.bigram_freqs = np.zeros(0, dtype=np.int64)
+        self.bigram_first = np.zeros(0, dtype=np.int64)
+        self.content_word_total = 0
+        self.first_content_word = -1
+        self.last_content_word = -1
+        self.pending_bigrams = []
+        self.pending_size = 0
+        self.pending_start = 0
+
+    def reserve(self, size):
+        """Grows the per-token arrays geometrically so they hold at least `size` IDs."""
+        if size <= len(self.token_freqs):
+            return
+        capacity = max(size, 2 * len(self.token_freqs), 1024)
+        for name in ("token_freqs", "is_word", "is_content_word"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def intern(self, tokens):
+        """Maps tokens to IDs, adding unseen tokens to the vocabulary."""
+        vocab_size = len(self.vocab)
+        get_id = self.token_ids.setdefault
+        ids = np.array([get_id(token, len(self.token_ids)) for token in tokens], dtype=np.int64)
+        if len(self.token_ids) > vocab_size:
+            positions = np.flatnonzero(ids >= vocab_size)
+            _, first = np.unique(ids[positions], return_index=True)
+            new_tokens = [tokens[i] for i in positions[first]]
+            self.vocab.extend(new_tokens)
+            self.reserve(len(self.vocab))
+            # Only alphabetic tokens count as words, and only non-stopword words as content words
+            is_word = np.array([token.isalpha() for token in new_tokens], dtype=bool)
+            is_stopword = np.array([token.lower() in self.stop_words for token in new_tokens], dtype=bool)
+            self.is_word[vocab_size:len(self.vocab)] = is_word
+            self.is_content_word[vocab_size:len(self.vocab)] = is_word & ~is_stopword
+        return ids
+
+    def update(self, tokens):
+        """Folds the next chunk of tokens into the counts."""
+        if not tokens:
+            return
+        with stage_trace.stage("intern_tokens", items=len(tokens)):
+            ids = self.intern(tokens)
+        with stage_trace.stage("count_tokens", items=len(ids)):
+            unique_ids, freqs = np.unique(ids, return_counts=True)
+            self.token_freqs[unique_ids] += freqs
+        with stage_trace.stage("filter_stopwords", items=len(ids)):
+            content_ids = ids[self.is_content_word[ids]]
+        if not content_ids.size:
+            return
+        # Bigrams continue across chunk boundaries, as if the corpus was one list
+        if self.last_content_word < 0:
+            self.first_content_word = int(content_ids[0])
+            sequence = content_ids
+            start = self.content_word_total
+        else:
+            sequence = np.concatenate(([self.last_content_word], content_ids))
+            start = self.content_word_total - 1
+        if not self.pending_bigrams:
+            self.pending_start = start
+        self.pending_bigrams.append(pack_bigrams(sequence[:-1], sequence[1:]))
+        self.pending_size += len(sequence) - 1
+        self.content_word_total += len(content_ids)
+        self.last_content_word = int(content_ids[-1])
+        if self.pending_size > max(len(self.bigram_keys), 1 << 22):
+            self.flush_bigrams()
+
+    def flush_bigrams(self):
+        """Counts the buffered bigram keys and adds them to the bigram table."""
+        if not self.pending_bigrams:
+            return
+        with stage_trace.stage("count_bigrams", items=self.pending_size):
+            keys, first, freqs = np.unique(np.concatenate(self.pending_bigrams), return_index=True, return_counts=True)
+            # Buffered keys are consecutive in the corpus, so an index is an offset from pending_start
+            self.add_bigrams(keys, freqs, first + self.pending_start)
+        self.pending_bigrams = []
+        self.pending_size = 0
+
+    def add_bigrams(self, keys, freqs, first):
+        """Adds unique bigram keys with their counts and first-seen positions to the table."""
+        merged_keys = np.union1d(self.bigram_keys, keys)
+        merged_freqs = np.zeros(len(merged_keys), dtype=np.int64)
+        merged_first = np.full(len(merged_keys), np.iinfo(np.int64).max, dtype=np.int64)
+        old = np.searchsorted(merged_keys, self.bigram_keys)
+        merged_freqs[old] = self.bigram_freqs
+        merged_first[old] = self.bigram_first
+        new = np.searchsorted(merged_keys, keys)
+        merged_freqs[new] += freqs
+        merged_first[new] = np.minimum(merged_first[new], first)
+        self.bigram_keys, self.bigram_freqs, self.bigram_first = merged_keys, merged_freqs, merged_first
+
+    def compact(self):
+        """Flushes buffered bigrams and trims the per-token arrays to the vocabulary size."""
+        self.flush_bigrams()
+        size = len(self.vocab)
+        self.token_freqs = self.token_freqs[:size].copy()
+        self.is_word = self.is_word[:size].copy()
+        self.is_content_word = self.is_content_word[:size].copy()
+
+    def merge(self, other):
+        """Appends the counts of the part of the corpus that directly follows this one.
+
+        The other vocabulary is interned in its own first-seen order and bigram
+        positions are offset, so ties keep the same order as a serial pass.
+        """
+        self.flush_bigrams()
+        other.flush_bigrams()
+        id_map = self.intern(other.vocab)
+        self.token_freqs[id_map] += other.token_freqs[:len(other.vocab)]
+        if other.first_content_word < 0:
+            return
+        other_first, other_second = unpack_bigrams(other.bigram_keys)
+        if self.last_content_word < 0:
+            self.first_content_word = int(id_map[other.first_content_word])
+        else:
+            boundary = pack_bigrams(np.int64(self.last_content_word), id_map[other.first_content_word])
+            self.add_bigrams(np.array([boundary]), np.ones(1, dtype=np.int64), np.array([self.content_word_total - 1]))
+        self.add_bigrams(
+            pack_bigrams(id_map[other_first], id_map[other_second]),
+            other.bigram_freqs,
+            other.bigram_first + self.content_word_total,
+        )
+        self.content_word_total += other.content_word_total
+        self.last_content_word = int(id_map[other.last_content_word])
+
+def count_file(tokenized_file, stop_words, chunk_size=1 << 20, workers=1):
+    """Counts a whole tokenized file, splitting it into shards across `workers` processes if > 1."""
+    if workers <= 1:
+        with stage_trace.stage("count_file", file=tokenized_file):
+            return count_shard(tokenized_file, 0, None, stop_words, chunk_size)
+    counts = TokenCounts(stop_words)
+    with stage_trace.stage("count_file", file=tokenized_file, workers=workers):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(count_shard, tokenized_file, start, end, stop_words, chunk_size)
+                for start, end in shard_offsets(tokenized_file, workers)
+            ]
+            for future in futures:
+                shard_counts = future.result()
+                with stage_trace.stage("merge_counts", items=len(shard_counts.vocab)):
+                    counts.merge(shard_counts)
+    return counts
+
+def read_head_lines(tokenized_file, n=20):
+    """Returns the first `n` lines of a file, stripped."""
+    with open(tokenized_file, "r", encoding="utf-8") as f:
+        return [line.strip() for line in islice(f, n)]
+
+class CountStore:
+    """On-disk store of corpus counts that new tokenized files are folded into.
+
+    Each added file is recorded with its size and modification time so it is
+    only counted once. Files are treated as consecutive parts of one corpus,
+    so bigrams continue from the end of one file into the next.
+    """
+
+    COUNT_FIELDS = (
+        "vocab", "token_freqs", "is_word", "is_content_word",
+        "bigram_keys", "bigram_freqs", "bigram_first",
+        "content_word_total", "first_content_word", "last_content_word",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = TokenCounts(set(stopwords.words("english")))
+        self.head_lines = []
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            self.counts = TokenCounts(state["stop_words"])
+            for name in self.COUNT_FIELDS:
+                setattr(self.counts, name, state[name])
+            self.counts.token_ids = {token: i for i, token in enumerate(self.counts.vocab)}
+            self.head_lines = state["head_lines"]
+            self.files = state["files"]
+
+    def add_file(self, tokenized_file, chunk_size=1 << 20, workers=1):
+        """Counts a tokenized file and merges it into the store. Returns False if it was already added."""
+        key = os.path.abspath(tokenized_file)
+        stat = os.stat(tokenized_file)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if key in self.files:
+            if self.files[key] != signature:
+                raise ValueError(f"{tokenized_file} was already added to {self.path} but has changed since.")
+            return False
+        if not self.files:
+            self.head_lines = read_head_lines(tokenized_file)
+        self.counts.merge(count_file(tokenized_file, self.counts.stop_words, chunk_size, workers))
+        self.files[key] = signature
+        return True
+
+    def save(self):
+        """Writes the store atomically, so an interrupted run keeps the previous state."""
+        self.counts.compact()
+        state = {name: getattr(self.counts, name) for name in self.COUNT_FIELDS}
+        state.update(stop_words=self.counts.stop_words, head_lines=self.head_lines, files=self.files)
+        tmp_path = self.path + ".tmp"
+        with stage_trace.stage("save_store", items=len(self.counts.vocab)):
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
 class CorpusAnalyzer:
-    def __init__(self, tokenized_file):
-        """Initialize with the path to the tokenized output file."""
+    def __init__(self, tokenized_file, chunk_size=1 << 20, workers=1, store=None):
+        """Initialize with the path to the tokenized output file.
+
+        The file is streamed once in chunks of roughly `chunk_size` bytes and
+        only running counters are kept, so memory grows with the vocabulary
+        rather than with the corpus. With `workers` > 1 the file is split into
+        line-aligned shards that are counted in a process pool and merged.
+
+        If a CountStore is given, the file is folded into it (unless it was
+        added before) and the analysis covers every file in the store.
+        `tokenized_file` may then be None to report on the store as it is.
+        """
         self.tokenized_file = tokenized_file
-        self.tokens = self.read_tokens()
-        self.token_counts = Counter(self.tokens)
-        self.sorted_tokens = self.token_counts.most_common()
-        self.words_only = self.filter_words()
-        self.content_words = self.remove_stopwords()
-        self.bigrams = self.compute_bigrams()
-
-    def read_tokens(self):
-        """Reads tokenized output and returns a list of tokens."""
-        with open(self.tokenized_file, "r", encoding="utf-8") as f:
-            return [line.strip() for line in f if line.strip()]  # Remove empty lines
+        self.chunk_size = chunk_size
+        self.workers = workers
+        if store is not None:
+            if tokenized_file is not None:
+                store.add_file(tokenized_file, chunk_size, workers)
+            counts = store.counts
+            self.head_lines = store.head_lines
+        else:
+            counts = count_file(tokenized_file, set(stopwords.words("english")), chunk_size, workers)
+            self.head_lines = read_head_lines(tokenized_file)
+        counts.compact()
+        self.counts = counts
+        self.stop_words = counts.stop_words
+        self.vocab = counts.vocab
+        self.token_freqs = counts.token_freqs
+        with stage_trace.stage("derive_frequencies", items=len(self.vocab)):
+            self.word_freqs = np.where(counts.is_word, counts.token_freqs, 0)
+            self.content_word_freqs = np.where(counts.is_content_word, counts.token_freqs, 0)
+            self.sorted_token_ids = top_k(self.token_freqs)
 
     def count_tokens(self):
         """Computes total token count, unique tokens, and type-token ratio."""
-        total_tokens = len(self.tokens)
-        unique_tokens = len(set(self.tokens))
+        total_tokens = int(self.token_freqs.sum())
+        unique_tokens = len(self.vocab)
         type_token_ratio = unique_tokens / total_tokens if total_tokens > 0 else 0
         return total_tokens, unique_tokens, type_token_ratio
 
     def write_token_frequencies(self):
         """Writes token frequencies to a file."""
-        with open("tokens.txt", "w", encoding="utf-8") as f:
-            for token, freq in self.sorted_tokens:
-                f.write(f"{token}\t{freq}\n")
+        with stage_trace.stage("write_token_frequencies", items=len(self.vocab)):
+            with open("tokens.txt", "w", encoding="utf-8") as f:
+                for token_id in self.sorted_token_ids.tolist():
+                    f.write(f"{self.vocab[token_id]}\t{self.token_freqs[token_id]}\n")
 
     def count_single_occurrence_tokens(self):
         """Counts the number of tokens that appear only once."""
-        return sum(1 for token, freq in self.token_counts.items() if freq == 1)
-
-    def filter_words(self):
-        """Filters out punctuation and symbols, keeping only alphabetic words."""
-        return [token for token in self.tokens if token.isalpha()]
+        return int(np.count_nonzero(self.token_freqs == 1))
 
     def compute_word_statistics(self):
         """Computes total words, unique words, and type/token ratio for words only."""
-        total_words = len(self.words_only)
-        unique_words = len(set(self.words_only))
+        total_words = int(self.word_freqs.sum())
+        unique_words = int(np.count_nonzero(self.word_freqs))
         type_token_ratio_words = unique_words / total_words if total_words > 0 else 0
         return total_words, unique_words, type_token_ratio_words
 
-    def remove_stopwords(self):
-        """Removes stopwords from token list."""
-        stop_words = set(stopwords.words("english"))
-        return [token for token in self.words_only if token.lower() not in stop_words]
-
     def compute_content_word_statistics(self):
         """Computes total content words and lexical density."""
-        total_content_words = len(self.content_words)
-        unique_content_words = len(set(self.content_words))
+        total_content_words = int(self.content_word_freqs.sum())
+        unique_content_words = int(np.count_nonzero(self.content_word_freqs))
         lexical_density = unique_content_words / total_content_words if total_content_words > 0 else 0
         return total_content_words, unique_content_words, lexical_density
 
-    def compute_bigrams(self):
-        """Computes frequency of bigrams from a list of words."""
-        return Counter(bigrams(self.content_words)).most_common()
+    def most_common(self, freqs, k):
+        """Returns the `k` most frequent tokens with a non-zero count in `freqs` as (token, freq) pairs."""
+        token_ids = top_k(freqs, k)
+        return [(self.vocab[i], int(freqs[i])) for i in token_ids.tolist() if freqs[i] > 0]
+
+    def compute_bigrams(self, k=None):
+        """Returns the `k` most frequent bigrams as ((word, word), freq) pairs, most frequent first."""
+        counts = self.counts
+        indices = top_k(counts.bigram_freqs, k, counts.bigram_first)
+        first_ids, second_ids = unpack_bigrams(counts.bigram_keys[indices])
+        return [
+            ((self.vocab[a], self.vocab[b]), freq)
+            for a, b, freq in zip(first_ids.tolist(), second_ids.tolist(), counts.bigram_freqs[indices].tolist())
+        ]
 
     def generate_report(self):
         """Generates a structured report and saves it to report.txt"""
@@ -72,19 +394,15 @@ class CorpusAnalyzer:
         total_words, unique_words, type_token_ratio_words = self.compute_word_statistics()
         total_content_words, unique_content_words, lexical_density = self.compute_content_word_statistics()
         tokens_once = self.count_single_occurrence_tokens()
-        top_20_words = Counter(self.words_only).most_common(20)
-        top_20_content_words = Counter(self.content_words).most_common(20)
-        top_20_bigrams = self.bigrams[:20]
+        top_20_tokens = self.most_common(self.token_freqs, 20)
+        top_20_words = self.most_common(self.word_freqs, 20)
+        top_20_content_words = self.most_common(self.content_word_freqs, 20)
+        top_20_bigrams = self.compute_bigrams(20)
 
         with open("report.txt", "w", encoding="utf-8") as report:
             # Section (a): First 20 lines of output.txt
             report.write("### (a) First 20 lines of Tokenized Output (output.txt):\n")
-            try:
-                with open(self.tokenized_file, "r", encoding="utf-8") as f:
-                    lines = [line.strip() for line in f][:20]
-                    report.write("\n".join(lines) + "\n\n")
-            except FileNotFoundError:
-                report.write("ERROR: output.txt not found.\n\n")
+            report.write("\n".join(self.head_lines) + "\n\n")
 
             # Section (b): Token and Type Statistics
             report.write("### (b) Token and Type Statistics:\n")
@@ -94,12 +412,8 @@ class CorpusAnalyzer:
 
             # Section (c): First 20 lines from tokens.txt
             report.write("### (c) First 20 Lines from Token Frequency File (tokens.txt):\n")
-            try:
-                with open("tokens.txt", "r", encoding="utf-8") as f:
-                    lines = [line.strip() for line in f][:20]
-                    report.write("\n".join(lines) + "\n\n")
-            except FileNotFoundError:
-                report.write("ERROR: tokens.txt not found.\n\n")
+            lines = [f"{token}\t{freq}" for token, freq in top_20_tokens]
+            report.write("\n".join(lines) + "\n\n")
 
             # Section (d): Tokens Appearing Only Once
             report.write("### (d) Tokens Appearing Only Once:\n")
@@ -136,8 +450,32 @@ class CorpusAnalyzer:
     def run_analysis(self):
         """Runs all steps of the analysis and saves results."""
         self.write_token_frequencies()
-        self.generate_report()
+        with stage_trace.stage("generate_report"):
+            self.generate_report()
 
 if __name__ == "__main__":
-    analyzer = CorpusAnalyzer("output_nltk.txt")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tokenized_files", nargs="*", default=[],
+        help="Paths to the tokenized output files, output_nltk.txt if none are given without --store.")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of processes used to count the file.")
+    parser.add_argument("--store", "-s", type=str, default=None,
+        help="Count store to fold the files into. Files already in the store are not counted again.")
+    parser.add_argument("--trace", type=str, default=None,
+        help="Write a stage timing trace to this file (.json for the Chrome trace format, JSON lines otherwise).")
+    args = parser.parse_args()
+    if args.trace is not None:
+        stage_trace.enable(args.trace)
+
+    if args.store is None:
+        if len(args.tokenized_files) > 1:
+            parser.error("multiple tokenized files require --store")
+        tokenized_file = args.tokenized_files[0] if args.tokenized_files else "output_nltk.txt"
+        analyzer = CorpusAnalyzer(tokenized_file, workers=args.workers)
+    else:
+        store = CountStore(args.store)
+        for tokenized_file in args.tokenized_files:
+            if not store.add_file(tokenized_file, workers=args.workers):
+                print(f"Skipping {tokenized_file}, already in {args.store}.")
+        store.save()
+        analyzer = CorpusAnalyzer(None, workers=args.workers, store=store)
     analyzer.run_analysis()
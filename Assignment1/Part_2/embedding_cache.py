@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+"""
+On-disk cache of sentence embeddings, one directory per model.
+
+Sentences are keyed by a hash of their exact text, and the model encodes that
+same text. Sentences are not normalized: tokenizers such as RoBERTa's
+byte-level BPE keep extra spaces and do not apply NFC, so a normalized sentence
+could get a different embedding and cached scores would differ from uncached
+ones. Vectors are appended to a float32 file that is
+read back through np.memmap, and keys.txt lists the hash of each row in order:
+
+  <cache_dir>/<model name>/meta.json     model name and embedding size
+  <cache_dir>/<model name>/keys.txt      one hex hash per line
+  <cache_dir>/<model name>/vectors.f32   rows of float32 embeddings
+
+Each unique sentence is encoded once per model; later runs only read vectors.
+"""
+
+
+def sentence_key(sentence):
+    """Hash of the exact text of a sentence."""
+    return hashlib.blake2b(sentence.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name):
+        self.model_name = model_name
+        self.path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.meta_path = os.path.join(self.path, "meta.json")
+        self.keys_path = os.path.join(self.path, "keys.txt")
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.dim = None
+        self.rows = {}
+        self.vectors = None
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model_name"] != model_name:
+                raise ValueError(f"{self.path} holds embeddings of {meta['model_name']}, not {model_name}.")
+            self.dim = meta["dim"]
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                for row, key in enumerate(f):
+                    self.rows[key.strip()] = row
+            # Drop vectors written by an interrupted run after their keys were lost
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(len(self.rows) * self.dim * 4)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, sentence):
+        return sentence_key(sentence) in self.rows
+
+    def load_vectors(self):
+        """Memory-maps the vectors file, reopening it after it has grown."""
+        if self.vectors is None or len(self.vectors) != len(self.rows):
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return self.vectors
+
+    def add(self, keys, embeddings):
+        """Appends embeddings for keys that are not cached yet."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "dim": self.dim}, f)
+        # Vectors go to disk before their keys so a key always has a full row
+        with open(self.vectors_path, "ab") as f:
+            f.write(embeddings.tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{key}\n" for key in keys)
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def encode(self, model, sentences, batch_size=64):
+        """Returns embeddings for sentences, encoding only the ones not cached yet."""
+        keys = [sentence_key(sentence) for sentence in sentences]
+        missing = {}
+        for key, sentence in zip(keys, sentences):
+            if key not in self.rows and key not in missing:
+                missing[key] = sentence
+        if missing:
+            embeddings = model.encode(
+                list(missing.values()), batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+            )
+            self.add(list(missing), embeddings)
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self.load_vectors()[[self.rows[key] for key in keys]]
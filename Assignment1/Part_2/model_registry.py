@@ -0,0 +1,172 @@
+import gc
+import sys
+import time
+from collections import OrderedDict
+
+"""
+Lazy loading of the STS sentence encoders.
+
+A ModelRegistry maps short names ("model_1", ...) to SentenceTransformer model
+names and only loads a model the first time it is used, so scoring one model
+does not pay for loading the other four (sentence_transformers itself is only
+imported then). Loaded models are kept in least-recently-used order; when their
+estimated size (parameters and buffers) would exceed `memory_budget_mb`, or a
+model has not been used for `max_idle_s` seconds, models are dropped and
+reloaded on their next use.
+
+Models are evicted before a new one is loaded, using its size from an earlier
+load or from STS_MODEL_SIZES_MB, so the loaded models stay within the budget.
+A model whose size is not known yet is measured once loaded and the budget is
+enforced then, so for its first load the budget is a soft limit.
+
+registry.encoder(name) returns a handle whose encode() loads the model on
+demand. Passed to EmbeddingCache.encode, it means a run whose sentences are
+all cached never loads the model at all.
+"""
+
+STS_MODELS = {
+    "model_1": "sentence-transformers/all-MiniLM-L6-v2",
+    "model_2": "sentence-transformers/all-mpnet-base-v2",
+    "model_3": "sentence-transformers/sentence-t5-large",
+    "model_4": "sentence-transformers/msmarco-roberta-base-v2",
+    "model_5": "sentence-transformers/all-distilroberta-v1",
+}
+
+# Approximate float32 parameter sizes, used before a model has been loaded once
+STS_MODEL_SIZES_MB = {
+    "sentence-transformers/all-MiniLM-L6-v2": 87,
+    "sentence-transformers/all-mpnet-base-v2": 418,
+    "sentence-transformers/sentence-t5-large": 1281,
+    "sentence-transformers/msmarco-roberta-base-v2": 476,
+    "sentence-transformers/all-distilroberta-v1": 313,
+}
+
+
+def load_sentence_transformer(model_name, device):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, device=device)
+
+
+def model_size_mb(model):
+    """Size of the parameters and buffers of a torch module, in MB. 0 for other objects."""
+    if not hasattr(model, "parameters"):
+        return 0.0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors) / (1 << 20)
+
+
+class LazyEncoder:
+    """Stands in for a model in encode calls, loading it from the registry on the first one."""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def encode(self, *args, **kwargs):
+        return self.registry.get(self.name).encode(*args, **kwargs)
+
+
+class ModelRegistry:
+    def __init__(self, models=None, device="cpu", memory_budget_mb=None, max_idle_s=None,
+                 loader=load_sentence_transformer, model_sizes_mb=None):
+        """
+        models: short name -> model name, STS_MODELS by default.
+        memory_budget_mb: total estimated size of the loaded models, None for no limit.
+        model_sizes_mb: model name -> expected size in MB, added to STS_MODEL_SIZES_MB.
+        max_idle_s: models unused for this long are dropped on the next get(), None to keep them.
+        loader: function (model_name, device) -> model.
+        """
+        self.models = dict(STS_MODELS if models is None else models)
+        self.device = device
+        self.memory_budget_mb = memory_budget_mb
+        self.max_idle_s = max_idle_s
+        self.loader = loader
+        # model name -> size in MB, from STS_MODEL_SIZES_MB and updated with the measured size on each load
+        self.sizes = {**STS_MODEL_SIZES_MB, **(model_sizes_mb or {})}
+        # name -> (model, size in MB, time of last use), least recently used first
+        self.loaded = OrderedDict()
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def names(self):
+        return list(self.models)
+
+    def model_name(self, name):
+        return self.models[name]
+
+    def register(self, name, model_name):
+        if name in self.loaded and self.models.get(name) != model_name:
+            self.evict(name)
+        self.models[name] = model_name
+
+    def encoder(self, name):
+        """Handle with an encode() method that only loads the model when it is called."""
+        if name not in self.models:
+            raise KeyError(f"Unknown model {name!r}, expected one of {', '.join(self.models)}.")
+        return LazyEncoder(self, name)
+
+    def get(self, name):
+        """Returns the model, loading it on first use."""
+        if name not in self.models:
+            raise KeyError(f"Unknown model {name!r}, expected one of {', '.join(self.models)}.")
+        self.evict_idle(keep=name)
+        if name in self.loaded:
+            model, size, _ = self.loaded.pop(name)
+        else:
+            model_name = self.models[name]
+            # Room is made before loading, so the new model never comes on top of a full budget
+            self.enforce_budget(extra_mb=self.sizes.get(model_name, 0.0))
+            model = self.loader(model_name, self.device)
+            size = model_size_mb(model)
+            self.sizes[model_name] = size
+        self.loaded[name] = (model, size, time.monotonic())
+        # Also catches a first load whose size was unknown or underestimated
+        self.enforce_budget(keep=name)
+        return model
+
+    def memory_mb(self):
+        """Estimated size of the loaded models."""
+        return sum(size for _, size, _ in self.loaded.values())
+
+    def evict(self, name):
+        """Drops a loaded model. It is loaded again on its next use."""
+        if self.loaded.pop(name, None) is not None:
+            release_memory()
+
+    def evict_idle(self, keep=None):
+        if self.max_idle_s is None:
+            return
+        now = time.monotonic()
+        for name, (_, _, last_used) in list(self.loaded.items()):
+            if name != keep and now - last_used > self.max_idle_s:
+                self.evict(name)
+
+    def enforce_budget(self, keep=None, extra_mb=0.0):
+        """
+        Drops least recently used models until the loaded ones and extra_mb more fit in the budget.
+        `keep` is never dropped.
+        """
+        if self.memory_budget_mb is None:
+            return
+        for name in list(self.loaded):
+            if self.memory_mb() + extra_mb <= self.memory_budget_mb:
+                break
+            if name != keep:
+                self.evict(name)
+
+    def clear(self):
+        for name in list(self.loaded):
+            self.evict(name)
+
+
+def release_memory():
+    gc.collect()
+    # Only touch torch if a model already imported it
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,191 @@
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+"""
+Pearson correlation of STS system outputs against gold standard files.
+
+This follows correlation-noconfidence.pl line for line:
+  * lines starting with '#' are skipped in both files,
+  * a blank gold line filters out the system line with the same number,
+  * the first whitespace-separated field of a line is its score, read like a
+    Perl number (leading numeric prefix, otherwise 0),
+  * the correlation runs over as many pairs as there are gold scores; when
+    the system has fewer scores, the missing ones have weight 0 in every sum
+    except the mean of the gold scores,
+  * a system (or gold) file whose scores are all equal has no correlation:
+    the Perl script dies with "Illegal division by zero" and exits 255, which
+    the command line mirrors. Such scores are NaN here; score_<model> files
+    leave them out, as the notebook did when the Perl script failed, and the
+    correlation table marks them N.A.
+
+All system files of a dataset are correlated against the gold scores at once.
+"""
+
+NUMBER = re.compile(r"\s*([+-]?(?:\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?))")
+
+
+def perl_number(field):
+    """Converts a string to a number the way Perl does in numeric context."""
+    match = NUMBER.match(field)
+    return float(match.group(1)) if match else 0.0
+
+
+def first_field(line):
+    """First field of split(/\\s+/, line); empty if the line starts with whitespace."""
+    fields = re.split(r"\s+", line)
+    return fields[0] if fields else ""
+
+
+def chomp(line):
+    """Removes one trailing "\n", like Perl's chomp."""
+    return line[:-1] if line.endswith("\n") else line
+
+
+def read_gold(gs_file):
+    """Returns the gold scores and the line numbers of system lines to filter out."""
+    scores = []
+    filtered = set()
+    line_number = 0
+    # Lines end at "\n" only and keep any "\r", as with Perl's chomp
+    with open(gs_file, "r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            line = chomp(line)
+            if line.startswith("#"):
+                continue
+            line_number += 1
+            if line == "":
+                filtered.add(line_number)
+            else:
+                scores.append(perl_number(first_field(line)))
+    return np.array(scores, dtype=np.float64), filtered
+
+
+def read_system(system_file, filtered):
+    """Returns the system scores kept after filtering.
+
+    Returns None if no system line was kept, in which case the Perl script prints nothing.
+    """
+    scores = []
+    line_number = 1
+    with open(system_file, "r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            if line_number not in filtered:
+                line = chomp(line)
+                # As in the Perl script, a skipped comment does not advance the line number
+                if line.startswith("#"):
+                    continue
+                scores.append(perl_number(first_field(line)))
+            line_number += 1
+    if not scores:
+        return None
+    return np.array(scores, dtype=np.float64)
+
+
+def pearson(gold, systems, weights):
+    """Weighted Pearson correlation of each row of `systems` with `gold`, as in the Perl script.
+
+    `weights` is 1 where a system score exists and 0 where it is missing. The
+    means divide by the number of gold scores in both cases. NaN where a variance is 0.
+    """
+    gold = gold - gold.mean()
+    systems = (systems - systems.sum(axis=1, keepdims=True) / len(gold)) * weights
+    covariance = systems @ gold
+    variance = np.einsum("ij,ij->i", systems, systems) * (weights @ (gold * gold))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(variance > 0, covariance / np.sqrt(variance), np.nan)
+
+
+def format_pearson(score):
+    """Formats a correlation like the Perl script's output line (without the newline)."""
+    if score is None or np.isnan(score):
+        return "Pearson: N.A."
+    return f"Pearson: {score:.5f}"
+
+
+def correlate(gs_file, system_files):
+    """Correlates several system files with one gold file.
+
+    Returns a list with one entry per system file: the correlation, NaN if it
+    is undefined, or None if the file is missing or has no scored lines.
+    """
+    gold, filtered = read_gold(gs_file)
+    results = [None] * len(system_files)
+    systems = np.zeros((len(system_files), len(gold)))
+    weights = np.zeros((len(system_files), len(gold)))
+    indices = []
+    for i, system_file in enumerate(system_files):
+        if not os.path.exists(system_file):
+            continue
+        scores = read_system(system_file, filtered)
+        if scores is None:
+            continue
+        # Scores past the number of gold scores are ignored, missing ones get weight 0
+        scores = scores[:len(gold)]
+        systems[i, :len(scores)] = scores
+        weights[i, :len(scores)] = 1
+        indices.append(i)
+    if indices and len(gold):
+        for i, score in zip(indices, pearson(gold, systems[indices], weights[indices]).tolist()):
+            results[i] = score
+    return results
+
+
+def evaluate(gs_files, output_files):
+    """Correlates every model's outputs with the gold files.
+
+    `output_files` maps a model name to its output files, aligned with `gs_files`.
+    Returns {model: [score per dataset]}.
+    """
+    models = list(output_files)
+    results = {model: [] for model in models}
+    for i, gs_file in enumerate(gs_files):
+        scores = correlate(gs_file, [output_files[model][i] for model in models])
+        for model, score in zip(models, scores):
+            results[model].append(score)
+    return results
+
+
+def write_score_files(folder_path, results):
+    """Writes score_<model> files with one 'Score N: Pearson: x' line per dataset.
+
+    Undefined (NaN) correlations get no line, where the Perl script would have died.
+    """
+    for model, scores in results.items():
+        with open(os.path.join(folder_path, f"score_{model}"), "w") as ps_file:
+            for i, score in enumerate(scores):
+                if score is not None and np.isnan(score):
+                    print(f"No correlation for {model} on dataset {i + 1}: Illegal division by zero")
+                    continue
+                ps_file.write(f"Score {i + 1}: {format_pearson(score)}\n")
+
+
+def write_correlation_table(output_file, results, dataset_names):
+    """Writes one 'model = Pearson: x' block per dataset, like correlation score.txt."""
+    with open(output_file, "w") as f:
+        for i, dataset_name in enumerate(dataset_names):
+            f.write(f"{dataset_name}\n")
+            for model, scores in results.items():
+                f.write(f"{model} = {format_pearson(scores[i])}\n")
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outputs the Pearson correlation.")
+    parser.add_argument("gs", help="Gold standard file.")
+    parser.add_argument("system", help="System output file.")
+    args = parser.parse_args()
+
+    score, = correlate(args.gs, [args.system])
+    if not os.path.exists(args.system):
+        print(format_pearson(None))
+        sys.exit(1)
+    if score is not None and np.isnan(score):
+        # The Perl script dies here, with perl's exit code for die
+        print("Illegal division by zero", file=sys.stderr)
+        sys.exit(255)
+    if score is not None:
+        print(format_pearson(score))
@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from sts_scoring import encode_sentences, parse_sts_line
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import stage_trace
+
+"""
+Approximate nearest-neighbour search over sentence embeddings, in NumPy.
+
+The index is an inverted file with scalar quantization (IVF-SQ8):
+  * spherical k-means splits the unit-normalized embeddings into `n_lists`
+    clusters, and each vector is stored in the list of its nearest centroid,
+  * vectors are stored as int8 codes with one scale per dimension, a quarter
+    of the float32 size,
+  * a query only scans the `n_probe` lists whose centroids are closest to it.
+
+Queries are searched in batches, list by list: all queries of a batch that
+probe a list are scored against it with one matrix product and merged into
+the running top k. Scores are cosine similarities (inner products of unit
+vectors), approximate because of the quantization unless the candidates are
+re-ranked with the float vectors.
+
+The index is saved as a directory of .npy files, and the codes are
+memory-mapped when it is loaded.
+"""
+
+
+def normalize(vectors):
+    """Returns float32 rows scaled to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.float32(1e-12))
+
+
+def nearest_centroids(vectors, centroids, batch_size=65536):
+    """Index of the centroid with the largest inner product for each row of vectors."""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        assignments[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """k-means on unit vectors with cosine similarity. Returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Summing contiguous runs of the vectors sorted by cluster is much faster than np.add.at
+        sums = np.zeros_like(centroids)
+        non_empty = counts > 0
+        starts = np.cumsum(counts) - counts
+        sums[non_empty] = np.add.reduceat(vectors[np.argsort(assignments, kind="stable")], starts[non_empty])
+        # An empty cluster restarts from a random vector
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def top_k_rows(scores, ids, k):
+    """Top k (scores, ids) of each row, best first. Rows with fewer than k columns are padded with -inf and -1."""
+    if scores.shape[1] < k:
+        pad = k - scores.shape[1]
+        scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def exact_search(vectors, queries, k, batch_size=1024):
+    """Brute-force top k inner products, the reference for recall."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    all_scores = np.empty((len(queries), k), dtype=np.float32)
+    all_ids = np.empty((len(queries), k), dtype=np.int64)
+    row_ids = np.arange(len(vectors))
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start:start + batch_size] @ vectors.T
+        ids = np.broadcast_to(row_ids, scores.shape)
+        all_scores[start:start + batch_size], all_ids[start:start + batch_size] = top_k_rows(scores, ids, k)
+    return all_scores, all_ids
+
+
+def recall_at_k(approximate_ids, exact_ids):
+    """Fraction of the exact top k ids found in the approximate top k, over all queries."""
+    k = exact_ids.shape[1]
+    hits = sum(len(np.intersect1d(a[a >= 0], e[e >= 0])) for a, e in zip(approximate_ids, exact_ids))
+    return hits / (len(exact_ids) * k) if len(exact_ids) else 0.0
+
+
+class IVFIndex:
+    def __init__(self, n_lists, n_probe=8):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        self.scale = None
+        self.codes = np.zeros((0, 0), dtype=np.int8)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def train(self, vectors, sample_size=None, n_iter=10, seed=0):
+        """Learns the centroids and the quantization scale from a sample of the vectors, 64 per list by default."""
+        vectors = normalize(vectors)
+        sample_size = sample_size or 64 * self.n_lists
+        if len(vectors) > sample_size:
+            vectors = vectors[np.random.default_rng(seed).choice(len(vectors), sample_size, replace=False)]
+        self.centroids = spherical_kmeans(vectors, self.n_lists, n_iter, seed)
+        self.scale = np.maximum(np.abs(vectors).max(axis=0), np.float32(1e-6)) / 127
+        self.codes = np.zeros((0, vectors.shape[1]), dtype=np.int8)
+        return self
+
+    def quantize(self, vectors):
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def add(self, vectors, ids=None):
+        """Adds vectors with their ids (by default, consecutive numbers after the current ones)."""
+        vectors = normalize(vectors)
+        if ids is None:
+            ids = np.arange(len(self.ids), len(self.ids) + len(vectors), dtype=np.int64)
+        lists = np.concatenate([np.repeat(np.arange(self.n_lists), np.diff(self.offsets)),
+                                nearest_centroids(vectors, self.centroids)])
+        codes = np.concatenate([np.asarray(self.codes), self.quantize(vectors)])
+        ids = np.concatenate([np.asarray(self.ids), np.asarray(ids, dtype=np.int64)])
+        # Rows are kept grouped by list, so a list is one contiguous slice
+        order = np.argsort(lists, kind="stable")
+        self.codes, self.ids = codes[order], ids[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.n_lists))])
+        return self
+
+    def search(self, queries, k=10, n_probe=None, batch_size=1024, rerank_vectors=None, rerank_factor=4):
+        """
+        Returns (scores, ids), each (n_queries, k), best first. Missing results have id -1.
+
+        With rerank_vectors (the float vectors, indexable by id), the top k * rerank_factor
+        candidates of the quantized scan are re-scored exactly.
+        """
+        queries = normalize(queries)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        candidates = k * rerank_factor if rerank_vectors is not None else k
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_ids = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            with stage_trace.stage("ann_search", items=len(batch), n_probe=n_probe):
+                scores, ids = self.scan(batch, candidates, n_probe)
+                if rerank_vectors is not None:
+                    scores, ids = self.rerank(batch, ids, rerank_vectors, k)
+            all_scores[start:start + len(batch)], all_ids[start:start + len(batch)] = scores[:, :k], ids[:, :k]
+        return all_scores, all_ids
+
+    def scan(self, queries, k, n_probe):
+        """Top k of the quantized scores over the n_probe nearest lists of each query."""
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, n_probe - 1, axis=1)[:, :n_probe]
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        # Queries are scaled instead of the codes: q . (code * scale) = (q * scale) . code
+        scaled_queries = queries * self.scale
+        probe_rows = np.repeat(np.arange(len(queries)), n_probe)
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        probe_rows, probe_lists = probe_rows[order], probe_lists[order]
+        bounds = np.searchsorted(probe_lists, np.arange(self.n_lists + 1))
+        for list_id in np.unique(probe_lists).tolist():
+            begin, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if begin == end:
+                continue
+            rows = probe_rows[bounds[list_id]:bounds[list_id + 1]]
+            scores = scaled_queries[rows] @ np.asarray(self.codes[begin:end], dtype=np.float32).T
+            ids = np.broadcast_to(np.asarray(self.ids[begin:end]), scores.shape)
+            scores, ids = top_k_rows(scores, ids, k)
+            merged = top_k_rows(np.hstack([best_scores[rows], scores]), np.hstack([best_ids[rows], ids]), k)
+            best_scores[rows], best_ids[rows] = merged
+        return best_scores, best_ids
+
+    @staticmethod
+    def rerank(queries, ids, vectors, k):
+        """Re-scores candidate ids with the float vectors and keeps the top k."""
+        valid = ids >= 0
+        candidates = normalize(np.asarray(vectors)[np.where(valid, ids, 0).ravel()]).reshape(ids.shape + (-1,))
+        scores = np.einsum("qd,qcd->qc", queries, candidates)
+        scores[~valid] = -np.inf
+        return top_k_rows(scores, ids, k)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_lists": self.n_lists, "n_probe": self.n_probe, "dim": int(self.centroids.shape[1])}, f)
+        for name in ("centroids", "scale", "codes", "ids", "offsets"):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(meta["n_lists"], meta["n_probe"])
+        for name in ("centroids", "scale", "offsets"):
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy")))
+        index.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mmap_mode)
+        index.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mmap_mode)
+        return index
+
+
+def default_n_lists(n_vectors):
+    """About 4 * sqrt(n) lists, the usual IVF sizing."""
+    return max(1, min(n_vectors, int(4 * np.sqrt(n_vectors))))
+
+
+def build_index(vectors, n_lists=None, n_probe=8, seed=0):
+    vectors = normalize(vectors)
+    index = IVFIndex(n_lists or default_n_lists(len(vectors)), n_probe)
+    with stage_trace.stage("ann_train", items=len(vectors), n_lists=index.n_lists):
+        index.train(vectors, seed=seed)
+    with stage_trace.stage("ann_add", items=len(vectors)):
+        return index.add(vectors)
+
+
+def encode_corpus(model, sentences, batch_size=64, cache=None):
+    """Unit-normalized embeddings of sentences, through an EmbeddingCache if given."""
+    if cache is not None:
+        return normalize(cache.encode(model, sentences, batch_size))
+    return normalize(encode_sentences(model, sentences, batch_size))
+
+
+def read_sentence_pool(input_files):
+    """Unique sentences of STS input files (both sides of every pair), in first-seen order."""
+    sentences = {}
+    for input_file in input_files:
+        with open(input_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for sentence in parse_sts_line(line):
+                    sentences.setdefault(sentence, None)
+    return list(sentences)
+
+
+def near_duplicates(index, vectors, threshold=0.9, k=10, n_probe=None, batch_size=1024, rerank=True):
+    """
+    Pairs (i, j, score) with i < j of indexed vectors whose similarity is at least threshold.
+    `vectors` are the indexed vectors by id, used as queries and for re-ranking.
+    """
+    vectors = normalize(vectors)
+    scores, ids = index.search(vectors, k + 1, n_probe, batch_size, rerank_vectors=vectors if rerank else None)
+    query_ids = np.broadcast_to(np.arange(len(vectors))[:, None], ids.shape)
+    # Neighbour lists are not symmetric, so a pair can be found from either side
+    keep = (scores >= threshold) & (ids >= 0) & (ids != query_ids)
+    first = np.minimum(query_ids[keep], ids[keep])
+    second = np.maximum(query_ids[keep], ids[keep])
+    scores = scores[keep]
+    # Pairs found twice keep their best score
+    order = np.lexsort((-scores, second, first))
+    first, second, scores = first[order], second[order], scores[order]
+    unique = np.ones(len(first), dtype=bool)
+    unique[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+    return list(zip(first[unique].tolist(), second[unique].tolist(), scores[unique].tolist()))
+
+
+if __name__ == "__main__":
+    from sentence_transformers import SentenceTransformer
+
+    parser = argparse.ArgumentParser(description="Builds an ANN index over STS sentences and reports its recall.")
+    parser.add_argument("input_files", nargs="+", help="STS input files, both sentences of each pair are indexed.")
+    parser.add_argument("--model", "-m", default="all-MiniLM-L6-v2", help="SentenceTransformer model name or path.")
+    parser.add_argument("--index-dir", "-o", default=None, help="Directory the index is saved to.")
+    parser.add_argument("--n-lists", type=int, default=None, help="Number of IVF lists, about 4 * sqrt(n) by default.")
+    parser.add_argument("--n-probe", type=int, default=8, help="Lists scanned per query.")
+    parser.add_argument("-k", type=int, default=10, help="Neighbours per query.")
+    parser.add_argument("--queries", type=int, default=1000, help="Sentences used as queries to measure recall.")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Similarity of the near-duplicate pairs listed.")
+    args = parser.parse_args()
+
+    sentences = read_sentence_pool(args.input_files)
+    vectors = encode_corpus(SentenceTransformer(args.model), sentences)
+    index = build_index(vectors, args.n_lists, args.n_probe)
+    if args.index_dir is not None:
+        index.save(args.index_dir)
+
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    _, exact_ids = exact_search(vectors, vectors[query_ids], args.k)
+    _, approximate_ids = index.search(vectors[query_ids], args.k)
+    _, reranked_ids = index.search(vectors[query_ids], args.k, rerank_vectors=vectors)
+    print(f"{len(sentences)} sentences, {index.n_lists} lists, n_probe={index.n_probe}")
+    print(f"recall@{args.k}: {recall_at_k(approximate_ids, exact_ids):.4f} "
+          f"(re-ranked: {recall_at_k(reranked_ids, exact_ids):.4f})")
+    pairs = sorted(near_duplicates(index, vectors, args.threshold), key=lambda pair: -pair[2])
+    print(f"{len(pairs)} pairs with similarity >= {args.threshold}")
+    for i, j, score in pairs[:20]:
+        print(f"{score:.4f}\t{sentences[i]}\t{sentences[j]}")
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import stage_trace
+
+"""
+Batched scoring of STS2016 sentence pairs with a SentenceTransformer model.
+
+Each input line holds two tab-separated sentences (followed by source notes).
+The output has one scaled similarity per line: cosine similarity in [-1, 1]
+mapped to [0, 5] as (cos + 1) * 2.5.
+"""
+
+
+def parse_sts_line(line):
+    """Returns the two sentences of an STS input line."""
+    s = line.strip().split("\t")
+    return s[0], s[1]
+
+
+def iter_sts_pairs(lines, chunk_size=4096):
+    """Groups STS input lines into chunks of (sentences_1, sentences_2) lists."""
+    sentences_1, sentences_2 = [], []
+    for line in lines:
+        s_1, s_2 = parse_sts_line(line)
+        sentences_1.append(s_1)
+        sentences_2.append(s_2)
+        if len(sentences_1) == chunk_size:
+            yield sentences_1, sentences_2
+            sentences_1, sentences_2 = [], []
+    if sentences_1:
+        yield sentences_1, sentences_2
+
+
+def read_sts_pairs(input_file):
+    """Reads a whole STS input file into two lists of sentences."""
+    with open(input_file, "r", encoding="utf-8") as in_file:
+        sentences_1, sentences_2 = [], []
+        for s_1, s_2 in map(parse_sts_line, in_file):
+            sentences_1.append(s_1)
+            sentences_2.append(s_2)
+    return sentences_1, sentences_2
+
+
+def scaled_similarity(embeddings_1, embeddings_2):
+    """Row-wise cosine similarity of two embedding matrices, scaled to [0, 5].
+
+    The cosine is computed in float32 like SentenceTransformer.similarity and
+    the scaling in float64 like (similarity(...).item() + 1) * 2.5, so scores
+    agree with the per-pair loop up to float32 rounding.
+    """
+    embeddings_1 = np.asarray(embeddings_1, dtype=np.float32)
+    embeddings_2 = np.asarray(embeddings_2, dtype=np.float32)
+    norms_1 = np.maximum(np.linalg.norm(embeddings_1, axis=1, keepdims=True), np.float32(1e-12))
+    norms_2 = np.maximum(np.linalg.norm(embeddings_2, axis=1, keepdims=True), np.float32(1e-12))
+    cosine = np.einsum("ij,ij->i", embeddings_1 / norms_1, embeddings_2 / norms_2)
+    return (cosine.astype(np.float64) + 1) * 2.5
+
+
+def encode_sentences(model, sentences, batch_size=64):
+    """Encodes a list of sentences with one batched encode call."""
+    return model.encode(sentences, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+
+def score_pairs(model, sentences_1, sentences_2, batch_size=64, cache=None):
+    """Scores aligned lists of sentences, encoding both sides together.
+
+    With an EmbeddingCache, only sentences missing from the cache are encoded.
+    """
+    with stage_trace.stage("encode", items=2 * len(sentences_1), cached=cache is not None):
+        if cache is None:
+            embeddings = encode_sentences(model, sentences_1 + sentences_2, batch_size)
+        else:
+            embeddings = cache.encode(model, sentences_1 + sentences_2, batch_size)
+    with stage_trace.stage("similarity", items=len(sentences_1)):
+        return scaled_similarity(embeddings[:len(sentences_1)], embeddings[len(sentences_1):])
+
+
+def write_scores(out_file, scores):
+    """Writes one score per line in the same format as f"{score}\\n"."""
+    with stage_trace.stage("write_scores", items=len(scores)):
+        out_file.writelines(f"{score}\n" for score in scores.tolist())
+
+
+def processing(input_file, output_file, model, batch_size=64, chunk_size=4096, cache=None):
+    """Scores every pair of an STS input file and writes the scaled similarities to output_file."""
+    with open(input_file, "r", encoding="utf-8") as in_file, open(output_file, "w") as out_file:
+        for sentences_1, sentences_2 in iter_sts_pairs(in_file, chunk_size):
+            write_scores(out_file, score_pairs(model, sentences_1, sentences_2, batch_size, cache))
@@ -2,58 +2,223 @@ import os
 import argparse
 import logging
 import json
-import pandas as pd
+from itertools import islice
+import numpy as np
+try:
+  import orjson
+  loads = orjson.loads
+except ImportError:
+  loads = json.loads
 """
-This script checks whether the results format for subtask A and subtask B is correct. 
+This script checks whether the results format for subtask A and subtask B is correct.
 It also provides some warnings about possible errors.
 
-The submission of the result file should be in jsonl format. 
+The submission of the result file should be in jsonl format.
 It should be a lines of objects:
 {
   id     -> identifier of the test sample,
   labels -> labels (0 or 1 for subtask A and from 0 to 5 for subtask B),
 }
 
+The file is read in chunks of lines. A chunk is parsed with one call of the
+JSON parser (orjson when installed); only a chunk with an error is parsed line
+by line, so every error is reported with its line number. Ids are checked to
+be unique and, given a gold file, to cover exactly the gold ids.
 """
 
 logging.basicConfig(format='%(levelname)s : %(message)s', level=logging.INFO)
 COLUMNS = ['id', 'label']
+CHUNK_LINES = 100000
+MAX_REPORTED_ERRORS = 10
 
 
-def check_format(file_path):
+class FormatErrors:
+  """Counts format errors and logs the first max_reported ones with their line numbers."""
+
+  def __init__(self, file_path, max_reported=MAX_REPORTED_ERRORS):
+    self.file_path = file_path
+    self.max_reported = max_reported
+    self.count = 0
+
+  def add(self, line_number, message):
+    self.count += 1
+    if self.count <= self.max_reported:
+      if line_number is None:
+        logging.error("{}: {}".format(self.file_path, message))
+      else:
+        logging.error("{}:{}: {}".format(self.file_path, line_number, message))
+
+  def close(self):
+    if self.count > self.max_reported:
+      logging.error("{}: {} more errors".format(self.file_path, self.count - self.max_reported))
+    return self.count == 0
+
+
+def is_integer(value):
+  return type(value) is int or (type(value) is float and value.is_integer())
+
+
+def iter_line_chunks(f, chunk_lines):
+  """Yields (first_line_number, lines) for chunks of chunk_lines lines of a binary file."""
+  first_line_number = 1
+  while True:
+    lines = list(islice(f, chunk_lines))
+    if not lines:
+      return
+    yield first_line_number, lines
+    first_line_number += len(lines)
+
+
+def parse_chunk_fast(lines):
+  """
+    Parses a chunk as one JSON array. Returns (ids, labels) lists, or None if any line
+    is blank, malformed or not an object with integer id and label.
+  """
+  try:
+    records = loads(b"[" + b",".join(lines) + b"]")
+  except ValueError:
+    return None
+  if len(records) != len(lines) or set(map(type, records)) != {dict}:
+    return None
+  try:
+    ids = [record['id'] for record in records]
+    labels = [record['label'] for record in records]
+  except KeyError:
+    return None
+  if set(map(type, ids)) != {int} or set(map(type, labels)) != {int}:
+    return None
+  return ids, labels
+
+
+def parse_chunk_lines(lines, first_line_number, errors):
+  """Parses a chunk line by line, adding each error to errors. Returns (ids, labels, line_numbers) lists."""
+  ids = []
+  labels = []
+  line_numbers = []
+  for line_number, line in enumerate(lines, first_line_number):
+    if not line.strip():
+      continue
+    try:
+      record = loads(line)
+    except ValueError:
+      errors.add(line_number, "not valid json")
+      continue
+    if not isinstance(record, dict):
+      errors.add(line_number, "not a json object")
+      continue
+    valid = True
+    for column in COLUMNS:
+      value = record.get(column)
+      if value is None:
+        errors.add(line_number, "NA value in column {}".format(column))
+        valid = False
+      elif not is_integer(value):
+        errors.add(line_number, "non-integer {} {!r}".format(column, value))
+        valid = False
+    if valid:
+      ids.append(int(record['id']))
+      labels.append(int(record['label']))
+      line_numbers.append(line_number)
+  return ids, labels, line_numbers
+
+
+def check_unique_ids(ids, line_numbers, errors):
+  order = np.argsort(ids, kind='stable')
+  sorted_ids = ids[order]
+  duplicates = np.flatnonzero(sorted_ids[1:] == sorted_ids[:-1]) + 1
+  for position in duplicates:
+    errors.add(line_numbers[order[position]], "duplicate id {} (first seen at line {})".format(
+      sorted_ids[position], line_numbers[order[np.searchsorted(sorted_ids, sorted_ids[position])]]))
+
+
+def check_coverage(ids, line_numbers, gold_ids, errors):
+  unknown = np.flatnonzero(~np.isin(ids, gold_ids))
+  for position in unknown:
+    errors.add(line_numbers[position], "id {} is not in the gold file".format(ids[position]))
+  missing = gold_ids[~np.isin(gold_ids, ids)]
+  if len(missing):
+    errors.add(None, "{} gold ids have no prediction, e.g. {}".format(
+      len(missing), ", ".join(str(id_) for id_ in missing[:5])))
+
+
+def read_labels(file_path, label_domain=range(0, 2), gold_ids=None, chunk_lines=CHUNK_LINES):
+  """
+    Reads the ids and labels of a jsonl file in one pass, checking each line on the way.
+
+    :param label_domain: allowed labels, None to accept any integer label.
+    :param gold_ids: if given, the ids of the file must be exactly these ids.
+    :param chunk_lines: number of lines parsed at a time.
+    :return: (ids, labels) int64 arrays in file order, or None if the file has a format error.
+  """
   if not os.path.exists(file_path):
     logging.error("File doesnt exists: {}".format(file_path))
-    return False
-  
-  try:
-    submission = pd.read_json(file_path, lines=True)[['id', 'label']]
-  except:
-    logging.error("File is not a valid json file: {}".format(file_path))
-    return False
-  
-  for column in COLUMNS:
-    if submission[column].isna().any():
-      logging.error("NA value in file {} in column {}".format(file_path, column))
-      return False
-  
-  if not submission['label'].isin(range(0, 2)).all():
-    logging.error("Unknown Label in file {}".format(file_path))
-    logging.error("Unique Labels in the file are {}".format(submission['label'].unique()))
-    return False
-      
-  return True
+    return None
+
+  errors = FormatErrors(file_path)
+  id_chunks = []
+  label_chunks = []
+  line_number_chunks = []
+  allowed_labels = None if label_domain is None else np.array(list(label_domain), dtype=np.int64)
+  with open(file_path, 'rb') as f:
+    for first_line_number, lines in iter_line_chunks(f, chunk_lines):
+      parsed = parse_chunk_fast(lines)
+      if parsed is not None:
+        ids, labels = parsed
+        line_numbers = np.arange(first_line_number, first_line_number + len(lines), dtype=np.int64)
+      else:
+        ids, labels, line_numbers = parse_chunk_lines(lines, first_line_number, errors)
+        line_numbers = np.array(line_numbers, dtype=np.int64)
+      try:
+        ids = np.array(ids, dtype=np.int64)
+        labels = np.array(labels, dtype=np.int64)
+      except OverflowError:
+        errors.add(first_line_number, "id or label out of the int64 range in the chunk starting here")
+        continue
+      if allowed_labels is not None:
+        for position in np.flatnonzero(~np.isin(labels, allowed_labels)):
+          errors.add(line_numbers[position], "unknown label {}".format(labels[position]))
+      id_chunks.append(ids)
+      label_chunks.append(labels)
+      line_number_chunks.append(line_numbers)
+
+  ids = np.concatenate(id_chunks) if id_chunks else np.empty(0, dtype=np.int64)
+  labels = np.concatenate(label_chunks) if label_chunks else np.empty(0, dtype=np.int64)
+  line_numbers = np.concatenate(line_number_chunks) if line_number_chunks else np.empty(0, dtype=np.int64)
+  check_unique_ids(ids, line_numbers, errors)
+  if gold_ids is not None:
+    check_coverage(ids, line_numbers, np.asarray(gold_ids, dtype=np.int64), errors)
+  if not errors.close():
+    return None
+  return ids, labels
+
+
+def read_gold_ids(gold_file_path):
+  gold = read_labels(gold_file_path, label_domain=None)
+  return None if gold is None else gold[0]
+
+
+def check_format(file_path, gold_ids=None):
+  return read_labels(file_path, gold_ids=gold_ids) is not None
 
 
 if __name__ == "__main__":
 
   parser = argparse.ArgumentParser()
-  parser.add_argument("--pred_files_path", "-p", nargs='+', required=True, 
+  parser.add_argument("--pred_files_path", "-p", nargs='+', required=True,
     help="Path to the files you want to check.", type=str)
+  parser.add_argument("--gold_file_path", "-g", type=str, default=None,
+    help="Optional gold file, the ids of each checked file must match its ids.")
 
   args = parser.parse_args()
   logging.info("Subtask A and B. Checking files: {}".format(args.pred_files_path))
-  
+
+  gold_ids = None
+  if args.gold_file_path is not None:
+    gold_ids = read_gold_ids(args.gold_file_path)
+    if gold_ids is None:
+      raise SystemExit("Bad format for gold file {}".format(args.gold_file_path))
+
   for pred_file_path in args.pred_files_path:
-    check_result = check_format(pred_file_path)
+    check_result = check_format(pred_file_path, gold_ids)
     result = 'Format is correct' if check_result else 'Something wrong in file format'
-    logging.info("Subtask A and B. Checking file: {}. Result: {}".format(args.pred_files_path, result))
+    logging.info("Subtask A and B. Checking file: {}. Result: {}".format(pred_file_path, result))
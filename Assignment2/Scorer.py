@@ -1,41 +1,141 @@
 import logging.handlers
 import argparse
-from sklearn.metrics import f1_score, accuracy_score
-import pandas as pd
+import numpy as np
 import sys
 sys.path.append('.')
-from FormatChecker import check_format
+from FormatChecker import check_format, read_labels
 
 """
-Scoring of SEMEVAL-Task-8--subtask-A-and-B  with the metrics f1-macro, f1-micro and accuracy. 
+Scoring of SEMEVAL-Task-8--subtask-A-and-B  with the metrics f1-macro, f1-micro and accuracy.
+
+Each file is read once into NumPy id and label arrays, and checked while it is
+read. Several prediction files can be scored against a gold file that is
+loaded once, with optional bootstrap confidence intervals of the metrics.
 """
 
-def evaluate(pred_fpath, gold_fpath):
+METRICS = ['macro-F1', 'micro-F1', 'accuracy']
+
+
+def align(gold_ids, gold_labels, pred_ids, pred_labels):
+  """
+    Returns the gold and predicted labels of the prediction ids found in the gold file,
+    like an inner merge on id.
+  """
+  order = np.argsort(gold_ids, kind='stable')
+  sorted_ids = gold_ids[order]
+  positions = np.searchsorted(sorted_ids, pred_ids).clip(max=max(len(sorted_ids) - 1, 0))
+  found = sorted_ids[positions] == pred_ids if len(sorted_ids) else np.zeros(len(pred_ids), dtype=bool)
+  return gold_labels[order[positions[found]]], pred_labels[found]
+
+
+def confusion_counts(gold, pred, num_classes):
+  """Confusion matrix (num_classes, num_classes) of class indices, rows are gold classes."""
+  cells = gold * num_classes + pred
+  return np.bincount(cells, minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+
+def scores_from_counts(counts):
+  """
+    Macro-F1, micro-F1 and accuracy of confusion matrices (rows are gold classes), with the
+    conventions of sklearn (zero_division=0, macro average over the labels present).
+  """
+  counts = counts.astype(np.float64)
+  true_positives = np.diagonal(counts, axis1=-2, axis2=-1)
+  gold_totals = counts.sum(axis=-1)
+  pred_totals = counts.sum(axis=-2)
+  denominators = gold_totals + pred_totals
+  with np.errstate(divide='ignore', invalid='ignore'):
+    f1 = np.where(denominators > 0, 2 * true_positives / denominators, 0.0)
+  present = denominators > 0
+  macro_f1 = (f1 * present).sum(axis=-1) / np.maximum(present.sum(axis=-1), 1)
+  total = counts.sum(axis=(-2, -1))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    accuracy = np.where(total > 0, true_positives.sum(axis=-1) / total, 0.0)
+  # Single-label classification: micro-averaged F1 equals accuracy
+  return macro_f1, accuracy, accuracy
+
+
+def encode_classes(gold, pred):
+  classes, encoded = np.unique(np.concatenate([gold, pred]), return_inverse=True)
+  return encoded[:len(gold)], encoded[len(gold):], len(classes)
+
+
+def score_labels(gold, pred):
+  gold, pred, num_classes = encode_classes(gold, pred)
+  return tuple(float(score) for score in scores_from_counts(confusion_counts(gold, pred, num_classes)))
+
+
+def bootstrap_ci(gold, pred, n_resamples=1000, confidence=0.95, seed=0):
+  """
+    Percentile bootstrap confidence intervals of macro-F1, micro-F1 and accuracy.
+    The metrics only depend on the confusion matrix, and resampling n rows with replacement
+    gives a multinomial draw of n over its cells, so each resample is drawn directly as
+    confusion counts: memory is O(n_resamples * num_classes**2), whatever the number of rows.
+
+    :return: {metric: (low, high)}
+  """
+  gold, pred, num_classes = encode_classes(gold, pred)
+  counts = confusion_counts(gold, pred, num_classes).ravel()
+  rng = np.random.default_rng(seed)
+  samples = rng.multinomial(len(gold), counts / counts.sum(), size=n_resamples)
+  resampled = scores_from_counts(samples.reshape(n_resamples, num_classes, num_classes))
+  alpha = (1 - confidence) / 2
+  intervals = {}
+  for metric, values in zip(METRICS, resampled):
+    low, high = np.quantile(values, [alpha, 1 - alpha])
+    intervals[metric] = (float(low), float(high))
+  return intervals
+
+
+def evaluate(pred_fpath, gold_fpath, label_domain=range(0, 2)):
   """
     Evaluates the predicted classes w.r.t. a gold file.
     Metrics are: f1-macro, f1-micro and accuracy
 
-    :param pred_fpath: a json file with predictions, 
+    :param pred_fpath: a json file with predictions,
     :param gold_fpath: the original annotated gold file.
+    :param label_domain: allowed predicted labels, range(0, 2) for subtask A, range(0, 6) for subtask B.
 
-    The submission of the result file should be in jsonl format. 
+    The submission of the result file should be in jsonl format.
     It should be a lines of objects:
     {
       id     -> identifier of the test sample,
       labels -> labels (0 or 1 for subtask A and from 0 to 5 for subtask B),
     }
   """
-  
-  pred_labels = pd.read_json(pred_fpath, lines=True)[['id', 'label']]
-  gold_labels = pd.read_json(gold_fpath, lines=True)[['id', 'label']]
+  results = evaluate_many([pred_fpath], gold_fpath, label_domain=label_domain)
+  if pred_fpath not in results:
+    raise ValueError('Bad format for pred file {}'.format(pred_fpath))
+  return results[pred_fpath]['scores']
 
-  merged_df = pred_labels.merge(gold_labels, on='id', suffixes=('_pred', '_gold'))
 
-  macro_f1 = f1_score(merged_df['label_gold'], merged_df['label_pred'], average="macro", zero_division=0)
-  micro_f1 = f1_score(merged_df['label_gold'], merged_df['label_pred'], average="micro", zero_division=0)
-  accuracy = accuracy_score(merged_df['label_gold'], merged_df['label_pred'])
-  
-  return macro_f1, micro_f1, accuracy
+def evaluate_many(pred_fpaths, gold_fpath, n_bootstrap=0, confidence=0.95, seed=0, label_domain=range(0, 2)):
+  """
+    Evaluates several prediction files against one gold file, read once.
+
+    :param label_domain: allowed predicted labels, range(0, 2) for subtask A, range(0, 6) for subtask B.
+    :param n_bootstrap: number of bootstrap resamples for confidence intervals, 0 for none.
+    :return: {pred_fpath: {'scores': (macro_f1, micro_f1, accuracy), 'ci': {metric: (low, high)} or None}},
+             files with a format error are left out.
+  """
+  gold = read_labels(gold_fpath, label_domain=None)
+  if gold is None:
+    raise ValueError('Bad format for gold file {}'.format(gold_fpath))
+  gold_ids, gold_labels = gold
+
+  results = {}
+  for pred_fpath in pred_fpaths:
+    # The prediction file is checked while it is read
+    pred = read_labels(pred_fpath, label_domain=label_domain)
+    if pred is None:
+      logging.error('Bad format for pred file {}. Cannot score.'.format(pred_fpath))
+      continue
+    gold_aligned, pred_aligned = align(gold_ids, gold_labels, *pred)
+    ci = None
+    if n_bootstrap > 0 and len(gold_aligned):
+      ci = bootstrap_ci(gold_aligned, pred_aligned, n_bootstrap, confidence, seed)
+    results[pred_fpath] = {'scores': score_labels(gold_aligned, pred_aligned), 'ci': ci}
+  return results
 
 
 def validate_files(pred_files):
@@ -48,15 +148,21 @@ def validate_files(pred_files):
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument( "--gold_file_path", '-g', type=str, required=True, help="Paths to the file with gold annotations.")
-  parser.add_argument("--pred_file_path", '-p', type=str, required=True, help="Path to the file with predictions")
+  parser.add_argument("--pred_file_path", '-p', type=str, nargs='+', required=True, help="Paths to the files with predictions")
+  parser.add_argument("--bootstrap", '-b', type=int, default=0, help="Number of bootstrap resamples for confidence intervals, 0 for none")
+  parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the bootstrap intervals")
+  parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling")
+  parser.add_argument("--num_labels", type=int, default=2, help="Number of labels, 2 for subtask A and 6 for subtask B")
   args = parser.parse_args()
 
-  pred_file_path = args.pred_file_path
-  gold_file_path = args.gold_file_path
-
-  if validate_files(pred_file_path):
-    logging.info('Prediction file format is correct')
-    macro_f1, micro_f1, accuracy = evaluate(pred_file_path, gold_file_path)
-    logging.info("macro-F1={:.5f}\tmicro-F1={:.5f}\taccuracy={:.5f}".format(macro_f1, micro_f1, accuracy))
-
-
+  results = evaluate_many(args.pred_file_path, args.gold_file_path, args.bootstrap, args.confidence, args.seed,
+                          label_domain=range(0, args.num_labels))
+  for pred_file_path, result in results.items():
+    logging.info('Prediction file format is correct: {}'.format(pred_file_path))
+    macro_f1, micro_f1, accuracy = result['scores']
+    logging.info("{}\tmacro-F1={:.5f}\tmicro-F1={:.5f}\taccuracy={:.5f}".format(pred_file_path, macro_f1, micro_f1, accuracy))
+    if result['ci'] is not None:
+      logging.info("{}\t{:.0%} bootstrap CI: {}".format(pred_file_path, args.confidence, "\t".join(
+        "{}=[{:.5f}, {:.5f}]".format(metric, *result['ci'][metric]) for metric in METRICS)))
+  if len(results) < len(args.pred_file_path):
+    sys.exit(1)
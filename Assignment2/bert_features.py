@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+"""
+Frozen BERT hidden states for training the BertBiLSTM head of part1.ipynb.
+
+BERT is frozen, so its last_hidden_state for a text never changes between
+epochs. precompute_hidden_states runs it once over all token ids and writes
+the states to an fp16 .npy file that is then memory-mapped; HiddenStateDataset
+serves rows of that file to the LSTM head, so an epoch only costs the head.
+"""
+
+
+def inputs_key(input_ids, attention_mask, model_name):
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(model_name.encode('utf-8'))
+  digest.update(np.ascontiguousarray(input_ids).tobytes())
+  digest.update(np.ascontiguousarray(attention_mask).tobytes())
+  return digest.hexdigest()
+
+
+def precompute_hidden_states(bert_model, input_ids, attention_mask, path, device="cpu", batch_size=64):
+  """
+    Returns a memory-mapped (n, seq_len, hidden_size) fp16 array of BERT's last_hidden_state.
+
+    The array is stored in `path` (.npy) together with a `path`.json key of the
+    inputs and model, and is reused as long as they match.
+  """
+  input_ids = np.asarray(input_ids)
+  attention_mask = np.asarray(attention_mask)
+  key = inputs_key(input_ids, attention_mask, bert_model.config._name_or_path)
+  meta_path = path + '.json'
+  if os.path.exists(path) and os.path.exists(meta_path):
+    with open(meta_path, 'r') as f:
+      if json.load(f)['key'] == key:
+        logging.info("Loaded BERT hidden states from {}".format(path))
+        return np.load(path, mmap_mode='c')
+
+  shape = input_ids.shape + (bert_model.config.hidden_size,)
+  states = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=shape)
+  # Dropout off, the stored states are the ones the frozen model gives at evaluation
+  was_training = bert_model.training
+  bert_model.eval()
+  with torch.no_grad():
+    for start in range(0, len(input_ids), batch_size):
+      batch_ids = torch.from_numpy(input_ids[start:start + batch_size]).long().to(device)
+      batch_mask = torch.from_numpy(attention_mask[start:start + batch_size]).long().to(device)
+      hidden_states = bert_model(batch_ids, attention_mask=batch_mask).last_hidden_state
+      states[start:start + len(batch_ids)] = hidden_states.half().cpu().numpy()
+  bert_model.train(was_training)
+  states.flush()
+  del states
+  # The key is written last, so an interrupted run is never reused
+  with open(meta_path, 'w') as f:
+    json.dump({'key': key, 'shape': list(shape)}, f)
+  logging.info("Saved BERT hidden states of {} texts to {}".format(shape[0], path))
+  return np.load(path, mmap_mode='c')
+
+
+class HiddenStateDataset(Dataset):
+  """
+    Rows of a precomputed hidden state array with their labels.
+
+    An index can be an int or an array of positions; with a batch sampler and
+    batch_size=None in the DataLoader, a whole batch is read from the memory
+    map with one fancy index and no per-row collation.
+
+    Given the attention mask, only positions up to the longest text of a batch
+    are read, and the batch's attention mask is returned with its states.
+  """
+
+  def __init__(self, hidden_states, labels, indices=None, attention_mask=None):
+    self.hidden_states = hidden_states
+    self.indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+    self.labels = torch.as_tensor(np.asarray(labels)[self.indices], dtype=torch.long)
+    self.attention_mask = None
+    if attention_mask is not None:
+      self.attention_mask = torch.as_tensor(np.asarray(attention_mask)[self.indices], dtype=torch.long)
+      self.lengths = self.attention_mask.sum(dim=1)
+
+  def __len__(self):
+    return len(self.indices)
+
+  def __getitem__(self, idx):
+    rows = self.indices[idx]
+    if self.attention_mask is None:
+      return {
+        "hidden_states": torch.from_numpy(np.asarray(self.hidden_states[rows])),
+        "labels": self.labels[idx]
+      }
+    length = int(self.lengths[idx].max())
+    return {
+      "hidden_states": torch.from_numpy(np.asarray(self.hidden_states[rows, :length])),
+      "attention_mask": self.attention_mask[idx, :length],
+      "labels": self.labels[idx]
+    }
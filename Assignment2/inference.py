@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import sys
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stage_trace
+"""
+Test-time inference for the TF-IDF + stylometric pipelines of part1.ipynb.
+
+The pipeline fitted in training (ColumnTransformer with the TfidfVectorizer
+and StandardScaler, followed by the classifier) is reused as is. The test
+JSONL file is read in fixed-size chunks; each chunk is featurized, turned
+into a scipy CSR matrix by the fitted preprocessor and classified, and its
+predictions are appended to the output file. Nothing is densified, so memory
+depends on the chunk size rather than on the test set size.
+"""
+
+NUMERIC_COLUMNS = ['log_punctuation_count', 'log_avg_sentence_length', 'log_perplexity']
+
+
+def save_pipeline(pipeline, path):
+  joblib.dump(pipeline, path)
+
+
+def load_pipeline(path):
+  return joblib.load(path)
+
+
+def make_featurizer(feature_store, perplexity_scorer):
+  """
+    Returns a function that adds the pipeline's input columns to a chunk of test data,
+    using a stylometry.FeatureStore and a perplexity.PerplexityScorer.
+  """
+  def featurize(chunk):
+    chunk = chunk.copy()
+    chunk['text'] = chunk['text'].fillna('').astype(str)
+    features = feature_store.features(chunk['text'])
+    chunk['log_punctuation_count'] = features['log_punctuation_count'].to_numpy()
+    chunk['log_avg_sentence_length'] = features['log_avg_sentence_length'].to_numpy()
+    chunk['log_perplexity'] = np.log1p(perplexity_scorer.score(chunk['text']))
+    return chunk
+  return featurize
+
+
+def transform_sparse(pipeline, frame):
+  """Runs every pipeline step but the classifier and returns a CSR matrix."""
+  features = pipeline[:-1].transform(frame[['text'] + NUMERIC_COLUMNS])
+  return sparse.csr_matrix(features) if not sparse.issparse(features) else features.tocsr()
+
+
+def iter_jsonl_chunks(file_path, chunk_size):
+  with pd.read_json(file_path, lines=True, chunksize=chunk_size) as reader:
+    for chunk in reader:
+      yield chunk
+
+
+def predict_jsonl(pipeline, test_fpath, output_fpath, featurize, chunk_size=10000):
+  """
+    Predicts every line of a test JSONL file and writes {"id", "label"} lines to output_fpath.
+
+    :param pipeline: fitted sklearn Pipeline, preprocessor steps followed by a classifier.
+    :param featurize: function adding NUMERIC_COLUMNS to a chunk DataFrame, see make_featurizer.
+    :param chunk_size: number of test lines held in memory at a time.
+  """
+  classifier = pipeline[-1]
+  total = 0
+  with open(output_fpath, 'w') as out_file:
+    for chunk in iter_jsonl_chunks(test_fpath, chunk_size):
+      with stage_trace.stage("featurize", items=len(chunk)):
+        features = featurize(chunk)
+      with stage_trace.stage("transform", items=len(chunk)):
+        X = transform_sparse(pipeline, features)
+      with stage_trace.stage("predict", items=len(chunk)):
+        labels = classifier.predict(X)
+      with stage_trace.stage("write_predictions", items=len(chunk)):
+        for id_, label in zip(chunk['id'], labels):
+          out_file.write(json.dumps({"id": int(id_), "label": int(label)}) + "\n")
+      total += len(chunk)
+      logging.info("Predicted {} lines".format(total))
+  return total
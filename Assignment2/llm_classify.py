@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import numpy as np
+import torch
+"""
+Batched classification with the fine-tuned causal LMs (Part2, Llama and Mistral notebooks).
+
+Instead of generating an answer and parsing the decoded string, each batch of
+prompts is left-padded and run through one forward pass. The logits of the
+next token are restricted to the first token of each label word ("0"/"1" or
+"Human"/"LLM") and the label with the highest logit is predicted. Prompts end
+exactly where the label started in the training text, and the label tokens are
+taken from the tokenization of prompt + label, so both match what the model saw
+in fine-tuning.
+
+Texts are cut so that a prompt fits in the model context (max_seq_length in
+the notebooks).
+
+Predictions are written as {"id", "label"} JSON lines, in the format checked
+by FormatChecker.py.
+"""
+
+
+def part2_prompt(text, tokenizer):
+  # Training texts were "... [/INST] {label} </s>", so the label follows the space
+  return f"<s>[INST] Classify the following text as 0 or 1 : {text} [/INST] "
+
+
+def llama_prompt(text, tokenizer):
+  prompt_text = (
+    "Please determine the origin of the following text and respond with 'LLM' if it is "
+    "generated by a language model or 'Human' if it is written by a person. Provide your "
+    "answer in the format: 'Classification: [LLM/Human]'.\n\nText:\n"
+    f"{text}\n\nClassification:"
+  )
+  messages = [{"role": "user", "content": prompt_text}]
+  return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def mistral_prompt(text, tokenizer):
+  prompt_text = (
+    "Classify the following text as 'LLM' if it was generated by a language model, "
+    "or 'Human' if it was written by a person. Respond with one word only.\n\n"
+    f"{text}"
+  )
+  messages = [{"role": "user", "content": prompt_text}]
+  return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+# Prompt format, whether the tokenizer should add special tokens, and the word of each label
+PROMPTS = {
+  'part2': (part2_prompt, True, {0: "0", 1: "1"}),
+  'llama': (llama_prompt, False, {0: "Human", 1: "LLM"}),
+  'mistral': (mistral_prompt, False, {0: "Human", 1: "LLM"}),
+}
+
+
+class ConstrainedClassifier:
+
+  def __init__(self, model, tokenizer, prompt='part2', device=None, batch_size=8, max_length=None,
+               max_text_tokens=None):
+    """
+      :param prompt: key of PROMPTS, or a (prompt_fn, add_special_tokens, label_words) tuple.
+      :param batch_size: number of prompts per forward pass.
+      :param max_length: maximum prompt length in tokens, by default the model's position limit.
+      :param max_text_tokens: texts are cut to this many tokens before being put in the prompt,
+        by default max_length minus the length of the prompt template.
+    """
+    self.model = model
+    self.tokenizer = tokenizer
+    self.prompt_fn, self.add_special_tokens, label_words = PROMPTS[prompt] if isinstance(prompt, str) else prompt
+    self.device = device if device is not None else model.device
+    self.batch_size = batch_size
+    if max_length is None:
+      config = model.config
+      max_length = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+    self.max_length = max_length
+    if max_text_tokens is None and max_length is not None:
+      max_text_tokens = max_length - len(self.encode(self.prompt_fn("", tokenizer)))
+      if max_text_tokens <= 0:
+        raise ValueError("The prompt template does not fit in {} tokens".format(max_length))
+    self.max_text_tokens = max_text_tokens
+    self.labels = np.array(list(label_words))
+    self.label_token_ids = [self.label_token_id(word) for word in label_words.values()]
+    if len(set(self.label_token_ids)) != len(self.label_token_ids):
+      raise ValueError("Label words {} start with the same token".format(list(label_words.values())))
+    if tokenizer.pad_token is None:
+      tokenizer.pad_token = tokenizer.eos_token
+
+  def encode(self, prompt):
+    return self.tokenizer(prompt, add_special_tokens=self.add_special_tokens)["input_ids"]
+
+  def label_token_id(self, word):
+    """
+      First token of a label word as it follows the prompt. Raises ValueError if the tokens of
+      prompt + word do not start with the tokens of the prompt, as the label logits would then
+      be read at the wrong position.
+    """
+    prompt = self.prompt_fn("text", self.tokenizer)
+    prompt_ids = self.encode(prompt)
+    full_ids = self.encode(prompt + word)
+    if len(full_ids) <= len(prompt_ids) or full_ids[:len(prompt_ids)] != prompt_ids:
+      raise ValueError(
+        "The end of the prompt and the label word {!r} are not tokenized separately: {!r}".format(
+          word, self.tokenizer.convert_ids_to_tokens(full_ids[max(len(prompt_ids) - 2, 0):]))
+      )
+    return full_ids[len(prompt_ids)]
+
+  def build_prompt(self, text):
+    """Puts text in the prompt template, cut so that the prompt fits in max_length tokens."""
+    if self.max_text_tokens is None:
+      return self.prompt_fn(text, self.tokenizer)
+    input_ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+    limit = self.max_text_tokens
+    while True:
+      if len(input_ids) > limit:
+        text = self.tokenizer.decode(input_ids[:limit])
+      prompt = self.prompt_fn(text, self.tokenizer)
+      # Decoding and re-tokenizing, or the template, can merge or split tokens, so the prompt is checked
+      excess = len(self.encode(prompt)) - self.max_length if self.max_length is not None else 0
+      if excess <= 0 or limit <= 0:
+        return prompt
+      limit = min(limit, len(input_ids)) - excess
+
+  def label_logits(self, prompts):
+    """Returns the next-token logits of the label tokens for a batch of prompts."""
+    padding_side = self.tokenizer.padding_side
+    self.tokenizer.padding_side = "left"
+    try:
+      inputs = self.tokenizer(
+        prompts, return_tensors="pt", padding=True, add_special_tokens=self.add_special_tokens
+      ).to(self.device)
+    finally:
+      self.tokenizer.padding_side = padding_side
+    attention_mask = inputs["attention_mask"]
+    # With left padding, positions have to start at the first real token of each row
+    position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+    with torch.no_grad():
+      logits = self.model(
+        input_ids=inputs["input_ids"], attention_mask=attention_mask, position_ids=position_ids
+      ).logits[:, -1, :]
+    return logits[:, self.label_token_ids].float().cpu().numpy()
+
+  def predict(self, texts):
+    """Returns the predicted label of each text."""
+    self.model.eval()
+    prompts = [self.build_prompt(str(text)) for text in texts]
+    # Similar prompt lengths share a batch, so there is little padding
+    order = np.argsort([len(prompt) for prompt in prompts], kind="stable")
+    predictions = np.empty(len(prompts), dtype=self.labels.dtype)
+    for start in range(0, len(order), self.batch_size):
+      batch = order[start:start + self.batch_size]
+      logits = self.label_logits([prompts[i] for i in batch])
+      predictions[batch] = self.labels[logits.argmax(axis=1)]
+    return predictions
+
+  def predict_jsonl(self, ids, texts, output_file, chunk_size=256):
+    """
+      Predicts texts and appends {"id", "label"} lines to output_file.
+      Ids already in output_file are skipped, so an interrupted run can be resumed.
+    """
+    completed_ids = set()
+    if os.path.exists(output_file):
+      with open(output_file, "r") as f:
+        for line in f:
+          if line.strip():
+            completed_ids.add(json.loads(line)["id"])
+    pending = [(id_, text) for id_, text in zip(ids, texts) if id_ not in completed_ids]
+    with open(output_file, "a") as f:
+      for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        labels = self.predict([text for _, text in chunk])
+        for (id_, _), label in zip(chunk, labels):
+          f.write(json.dumps({"id": int(id_), "label": int(label)}) + "\n")
+        f.flush()
+        logging.info("Predicted {}/{} texts".format(start + len(chunk), len(pending)))
+    return len(pending)
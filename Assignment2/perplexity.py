@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import numpy as np
+import torch
+import torch.nn.functional as F
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stage_trace
+"""
+Batched perplexity of texts under a causal language model (GPT-2 in part1.ipynb).
+
+Texts are tokenized without truncation. A text that fits in the model context
+is scored in one window; a longer one is scored with a sliding window that
+moves by `stride` tokens, each window only scoring the tokens the previous
+windows did not. Windows are sorted by length and packed into padded batches,
+and the attention mask and a per-token target mask keep padding out of both
+the model and the loss.
+
+Perplexities can be cached in a JSON lines file keyed by a hash of the text
+and the scoring settings, so re-runs and the test set only score new texts.
+"""
+
+
+def text_key(text, model_name, max_length, stride):
+  return hashlib.blake2b(
+    "\0".join([model_name, str(max_length), str(stride), text]).encode("utf-8"), digest_size=16
+  ).hexdigest()
+
+
+def sliding_windows(input_ids, max_length, stride):
+  """
+    Splits token ids into windows of at most max_length tokens.
+    Yields (window_ids, first_target), where first_target is the index in the
+    window of the first token scored by it.
+  """
+  if len(input_ids) <= max_length:
+    yield input_ids, 1
+    return
+  prev_end = 0
+  for begin in range(0, len(input_ids), stride):
+    end = min(begin + max_length, len(input_ids))
+    yield input_ids[begin:end], max(prev_end - begin, 1)
+    prev_end = end
+    if end == len(input_ids):
+      break
+
+
+class PerplexityScorer:
+
+  def __init__(self, model, tokenizer, device="cpu", model_name="gpt2", max_length=None, stride=512,
+               batch_size=16, max_batch_tokens=8192, chunk_size=4096, cache_path=None):
+    """
+      :param max_length: context size of a window, by default the model's position limit.
+      :param stride: step between sliding windows of long texts, at most max_length.
+      :param batch_size: maximum number of windows per forward pass.
+      :param max_batch_tokens: maximum padded tokens per forward pass, this bounds the size of the logits.
+      :param chunk_size: number of texts tokenized, scored and cached at a time.
+      :param cache_path: JSON lines file with cached perplexities, None to disable caching.
+    """
+    self.model = model
+    self.tokenizer = tokenizer
+    self.device = device
+    self.model_name = model_name
+    if max_length is None:
+      config = model.config
+      max_length = getattr(config, "n_positions", None) or getattr(config, "max_position_embeddings")
+    self.max_length = max_length
+    self.stride = min(stride, max_length)
+    self.batch_size = batch_size
+    self.max_batch_tokens = max_batch_tokens
+    self.chunk_size = chunk_size
+    self.cache_path = cache_path
+    self.cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+      with open(cache_path, "r") as f:
+        for line in f:
+          if line.strip():
+            record = json.loads(line)
+            self.cache[record["key"]] = record["perplexity"]
+      logging.info("Loaded {} cached perplexities from {}".format(len(self.cache), cache_path))
+
+  def score(self, texts):
+    """Returns the perplexity of each text as a float array, NaN for texts with less than two tokens."""
+    texts = [str(text) for text in texts]
+    keys = [text_key(text, self.model_name, self.max_length, self.stride) for text in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+      if key not in self.cache and key not in missing:
+        missing[key] = text
+    missing = list(missing.items())
+    stage_trace.count("perplexity_cache", hits=len(set(keys)) - len(missing), misses=len(missing))
+    for start in range(0, len(missing), self.chunk_size):
+      chunk = missing[start:start + self.chunk_size]
+      perplexities = self.score_uncached([text for _, text in chunk])
+      new_entries = dict(zip([key for key, _ in chunk], perplexities))
+      self.cache.update(new_entries)
+      if self.cache_path is not None:
+        with open(self.cache_path, "a") as f:
+          for key, perplexity in new_entries.items():
+            f.write(json.dumps({"key": key, "perplexity": perplexity}) + "\n")
+    return np.array([self.cache[key] for key in keys], dtype=np.float64)
+
+  def score_uncached(self, texts):
+    """Scores texts without looking at the cache."""
+    with stage_trace.stage("perplexity_tokenize", items=len(texts)):
+      encoded = self.tokenizer(texts, truncation=False, verbose=False)["input_ids"]
+      windows = []
+      for text_index, input_ids in enumerate(encoded):
+        for window_ids, first_target in sliding_windows(input_ids, self.max_length, self.stride):
+          if len(window_ids) > first_target:
+            windows.append((text_index, window_ids, first_target))
+    # Longest windows first, so similar lengths share a batch and memory peaks early
+    windows.sort(key=lambda window: len(window[1]), reverse=True)
+
+    nll_sums = np.zeros(len(texts), dtype=np.float64)
+    token_counts = np.zeros(len(texts), dtype=np.int64)
+    for batch in self.batches(windows):
+      with stage_trace.stage("perplexity_forward", items=sum(len(window[1]) for window in batch), windows=len(batch)):
+        sums, counts = self.score_batch(batch)
+      np.add.at(nll_sums, [window[0] for window in batch], sums)
+      np.add.at(token_counts, [window[0] for window in batch], counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+      return np.exp(nll_sums / token_counts).tolist()
+
+  def batches(self, windows):
+    """Groups windows sorted by length into batches within batch_size and max_batch_tokens."""
+    batch = []
+    for window in windows:
+      # The first window of a batch is its longest, so it sets the padded length
+      padded_length = len(batch[0][1]) if batch else len(window[1])
+      if batch and (len(batch) == self.batch_size or (len(batch) + 1) * padded_length > self.max_batch_tokens):
+        yield batch
+        batch = []
+      batch.append(window)
+    if batch:
+      yield batch
+
+  def score_batch(self, batch):
+    """Returns the summed negative log-likelihood and the number of scored tokens of each window."""
+    length = len(batch[0][1])
+    pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+    input_ids = torch.full((len(batch), length), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+    target_mask = torch.zeros((len(batch), length - 1), dtype=torch.float32)
+    for row, (_, window_ids, first_target) in enumerate(batch):
+      input_ids[row, :len(window_ids)] = torch.tensor(window_ids, dtype=torch.long)
+      attention_mask[row, :len(window_ids)] = 1
+      # Logit j predicts token j + 1
+      target_mask[row, first_target - 1:len(window_ids) - 1] = 1
+    input_ids = input_ids.to(self.device)
+    attention_mask = attention_mask.to(self.device)
+    target_mask = target_mask.to(self.device)
+
+    with torch.no_grad():
+      logits = self.model(input_ids, attention_mask=attention_mask).logits[:, :-1, :]
+      # Flattened to (tokens, vocab), so each row of logits is contiguous
+      nll = F.cross_entropy(
+        logits.reshape(-1, logits.size(-1)).float(), input_ids[:, 1:].reshape(-1), reduction="none"
+      ).view(len(batch), length - 1)
+    sums = (nll * target_mask).sum(dim=1)
+    return sums.double().cpu().numpy(), target_mask.sum(dim=1).long().cpu().numpy()
+
+
+def calculate_perplexities(texts, model, tokenizer, device="cpu", **kwargs):
+  """Perplexity of each text, see PerplexityScorer for the keyword arguments."""
+  return PerplexityScorer(model, tokenizer, device, **kwargs).score(texts)
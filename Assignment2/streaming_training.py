@@ -0,0 +1,200 @@
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler, normalize
+from inference import NUMERIC_COLUMNS, iter_jsonl_chunks
+from Scorer import confusion_counts, scores_from_counts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stage_trace
+"""
+Out-of-core training of the TF-IDF + stylometric pipeline of part1.ipynb.
+
+The training file (JSONL or CSV) is read in fixed-size chunks and never held
+in memory as a whole:
+  * the first pass counts document frequencies of hashed terms and feeds the
+    numeric features to StandardScaler.partial_fit,
+  * each following pass (one per epoch) transforms a chunk to a sparse TF-IDF
+    + scaled numeric CSR matrix and trains the classifier with partial_fit.
+
+HashingVectorizer replaces the TfidfVectorizer vocabulary, so memory depends
+on the chunk size and n_features, not on the number of texts or terms. The
+result is an sklearn Pipeline with a 'preprocessor' and a 'classifier' step,
+which save_pipeline, transform_sparse and predict_jsonl in inference.py use
+like the in-memory pipelines.
+
+Every pass featurizes its chunks again, so the stylometry.FeatureStore and
+perplexity.PerplexityScorer behind make_featurizer only compute each text once.
+They keep an in-memory index of the texts they have seen, about 140 bytes per
+text each (measured with tracemalloc), so a million training texts cost about
+0.3 GB on top of the chunk; everything else is bounded by the chunk size and
+n_features.
+"""
+
+
+class HashingTfidf(BaseEstimator, TransformerMixin):
+  """
+    TF-IDF of hashed terms with the defaults of TfidfVectorizer (smooth idf, l2 norm),
+    whose document frequencies are counted chunk by chunk with partial_fit.
+  """
+
+  def __init__(self, n_features=2 ** 20, stop_words='english', min_df=1):
+    """
+      :param n_features: number of hash buckets, the width of the TF-IDF matrix.
+      :param min_df: buckets found in fewer documents are dropped, like TfidfVectorizer's min_df.
+    """
+    self.n_features = n_features
+    self.stop_words = stop_words
+    self.min_df = min_df
+
+  def hashing_vectorizer(self):
+    return HashingVectorizer(n_features=self.n_features, stop_words=self.stop_words,
+                             alternate_sign=False, norm=None)
+
+  def partial_fit(self, texts, y=None):
+    counts = self.hashing_vectorizer().transform(texts).tocsr()
+    if not hasattr(self, 'document_frequency_'):
+      self.document_frequency_ = np.zeros(self.n_features, dtype=np.int64)
+      self.n_documents_ = 0
+    # Each stored entry of a CSR row is a distinct term of that document
+    self.document_frequency_ += np.bincount(counts.indices, minlength=self.n_features)
+    self.n_documents_ += counts.shape[0]
+    self.idf_ = np.log((1 + self.n_documents_) / (1 + self.document_frequency_)) + 1
+    self.idf_[self.document_frequency_ < self.min_df] = 0
+    return self
+
+  def fit(self, texts, y=None):
+    for attribute in ('document_frequency_', 'n_documents_', 'idf_'):
+      self.__dict__.pop(attribute, None)
+    return self.partial_fit(texts)
+
+  def transform(self, texts):
+    tfidf = self.hashing_vectorizer().transform(texts).tocsr().astype(np.float64)
+    tfidf.data *= self.idf_[tfidf.indices]
+    tfidf.eliminate_zeros()
+    return normalize(tfidf, norm='l2', copy=False)
+
+
+class StreamingPreprocessor(BaseEstimator, TransformerMixin):
+  """
+    Incremental counterpart of the notebook's ColumnTransformer: HashingTfidf on 'text'
+    and StandardScaler on NUMERIC_COLUMNS, stacked into one CSR matrix.
+  """
+
+  def __init__(self, n_features=2 ** 20, stop_words='english', min_df=1):
+    self.n_features = n_features
+    self.stop_words = stop_words
+    self.min_df = min_df
+
+  def partial_fit(self, frame, y=None):
+    if not hasattr(self, 'text_'):
+      self.text_ = HashingTfidf(self.n_features, self.stop_words, self.min_df)
+      self.num_ = StandardScaler()
+    self.text_.partial_fit(frame['text'])
+    self.num_.partial_fit(frame[NUMERIC_COLUMNS].to_numpy(dtype=np.float64))
+    return self
+
+  def fit(self, frame, y=None):
+    self.__dict__.pop('text_', None)
+    self.__dict__.pop('num_', None)
+    return self.partial_fit(frame)
+
+  def transform(self, frame):
+    numeric = self.num_.transform(frame[NUMERIC_COLUMNS].to_numpy(dtype=np.float64))
+    return sparse.hstack([self.text_.transform(frame['text']), sparse.csr_matrix(numeric)], format='csr')
+
+
+def iter_training_chunks(file_path, chunk_size):
+  """Yields DataFrames of at most chunk_size rows of a CSV or JSONL file."""
+  if file_path.endswith('.csv'):
+    with pd.read_csv(file_path, chunksize=chunk_size) as reader:
+      for chunk in reader:
+        yield chunk
+  else:
+    yield from iter_jsonl_chunks(file_path, chunk_size)
+
+
+def iter_split_chunks(file_path, featurize, chunk_size, validation_fraction, seed):
+  """
+    Yields (chunk_index, featurized chunk, validation mask). The mask only depends on the
+    seed and the position of a row, so every pass holds out the same rows.
+  """
+  for chunk_index, chunk in enumerate(iter_training_chunks(file_path, chunk_size)):
+    with stage_trace.stage("featurize", items=len(chunk)):
+      features = featurize(chunk.reset_index(drop=True))
+    validation = np.random.default_rng([seed, chunk_index]).random(len(chunk)) < validation_fraction
+    yield chunk_index, features, validation
+
+
+def train_streaming(train_fpath, featurize, classifier=None, n_features=2 ** 20, min_df=1, chunk_size=10000,
+                    n_epochs=1, validation_fraction=0.0, seed=0):
+  """
+    Trains a preprocessor + classifier pipeline from a training file read in chunks.
+
+    :param featurize: function adding NUMERIC_COLUMNS to a chunk DataFrame, see inference.make_featurizer.
+    :param classifier: estimator with partial_fit, by default a logistic regression trained by SGD.
+    :param chunk_size: number of training rows held in memory at a time.
+    :param n_epochs: passes of partial_fit over the training rows, shuffled within each chunk.
+    :param validation_fraction: fraction of rows held out from both the statistics and training.
+    :return: the fitted Pipeline and a dict of validation scores (empty without validation rows).
+  """
+  if classifier is None:
+    classifier = SGDClassifier(loss='log_loss', alpha=1e-5, random_state=seed)
+  if not hasattr(classifier, 'partial_fit'):
+    raise ValueError("{} has no partial_fit, it cannot be trained out of core.".format(type(classifier).__name__))
+  preprocessor = StreamingPreprocessor(n_features, min_df=min_df)
+
+  # Pass 1: IDF statistics, scaler statistics and the classes
+  classes = set()
+  for chunk_index, features, validation in iter_split_chunks(train_fpath, featurize, chunk_size,
+                                                             validation_fraction, seed):
+    if validation.all():
+      continue
+    with stage_trace.stage("fit_statistics", items=int((~validation).sum())):
+      preprocessor.partial_fit(features[~validation])
+    classes.update(features['label'][~validation].tolist())
+  if not classes:
+    raise ValueError("{} has no training rows".format(train_fpath))
+  classes = np.array(sorted(classes))
+  logging.info("Fitted IDF and scaler statistics on {} rows".format(preprocessor.text_.n_documents_))
+
+  # Following passes: incremental training
+  rng = np.random.default_rng(seed)
+  for epoch in range(n_epochs):
+    for chunk_index, features, validation in iter_split_chunks(train_fpath, featurize, chunk_size,
+                                                               validation_fraction, seed):
+      rows = rng.permutation(np.flatnonzero(~validation))
+      if len(rows) == 0:
+        continue
+      with stage_trace.stage("transform", items=len(rows)):
+        X = preprocessor.transform(features.iloc[rows])
+      with stage_trace.stage("partial_fit", items=len(rows), epoch=epoch):
+        classifier.partial_fit(X, features['label'].to_numpy()[rows], classes=classes)
+    logging.info("Finished epoch {} of {}".format(epoch + 1, n_epochs))
+
+  pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('classifier', classifier)])
+  if validation_fraction <= 0:
+    return pipeline, {}
+
+  # Validation scores from confusion counts summed over chunks
+  counts = np.zeros((len(classes), len(classes)), dtype=np.int64)
+  for chunk_index, features, validation in iter_split_chunks(train_fpath, featurize, chunk_size,
+                                                             validation_fraction, seed):
+    held_out = features[validation]
+    gold = held_out['label'].to_numpy()
+    known = np.isin(gold, classes)
+    if not known.any():
+      continue
+    pred = classifier.predict(preprocessor.transform(held_out[known]))
+    counts += confusion_counts(np.searchsorted(classes, gold[known]), np.searchsorted(classes, pred), len(classes))
+  macro_f1, micro_f1, accuracy = scores_from_counts(counts)
+  scores = {'macro-F1': float(macro_f1), 'micro-F1': float(micro_f1), 'accuracy': float(accuracy),
+            'validation_rows': int(counts.sum())}
+  logging.info("Validation scores: {}".format(scores))
+  return pipeline, scores
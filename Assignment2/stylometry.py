@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import string
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import nltk
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stage_trace
+"""
+Stylometric features of the SemEval Task 8 texts: punctuation count, average
+sentence length (in words) and their log1p transforms.
+
+Features are computed in chunks across a process pool and kept in an
+append-only store keyed by a hash of each text, so train and test inference
+load the same store and each text is only processed once:
+
+  <path>/keys.bin        16-byte blake2b hash of each text, one per row
+  <path>/<column>.npy    float64 values of each of FEATURE_COLUMNS, in row order
+
+Each column is a standard 1-D .npy file (np.load reads it) written with a
+fixed-size header, so new rows are appended to the data and only the shape in
+the header is rewritten: adding a chunk costs I/O for that chunk only. The
+columns are read through memory maps; the key -> row dict stays in memory,
+about 140 bytes per stored text.
+"""
+
+FEATURE_COLUMNS = ['punctuation_count', 'avg_sentence_length', 'log_punctuation_count', 'log_avg_sentence_length']
+
+# Size of the .npy header of the feature columns, room enough for any row count
+NPY_HEADER_SIZE = 128
+
+# Deletes every punctuation character, the count is the length difference
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+
+def count_punctuation(text):
+  return len(text) - len(text.translate(PUNCTUATION_TABLE))
+
+
+def avg_sentence_length(text):
+  sentences = nltk.sent_tokenize(text)
+  if len(sentences) == 0:
+    return 0
+  return sum(len(sentence.split()) for sentence in sentences) / len(sentences)
+
+
+def text_key(text):
+  return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def extract_chunk(texts):
+  """Returns an (n, 2) array of punctuation counts and average sentence lengths."""
+  features = np.empty((len(texts), 2), dtype=np.float64)
+  for i, text in enumerate(texts):
+    features[i, 0] = count_punctuation(text)
+    features[i, 1] = avg_sentence_length(text)
+  return features
+
+
+def extract_features(texts, workers=None, chunk_size=1000):
+  """
+    Computes the stylometric features of texts in chunks across `workers` processes.
+    Returns a DataFrame with FEATURE_COLUMNS, one row per text.
+  """
+  texts = ['' if text is None else str(text) for text in texts]
+  chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+  with stage_trace.stage("stylometry_extract", items=len(texts), workers=workers):
+    if workers == 1 or len(chunks) <= 1:
+      results = [extract_chunk(chunk) for chunk in chunks]
+    else:
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(extract_chunk, chunks))
+  raw = np.vstack(results) if results else np.empty((0, 2))
+  return pd.DataFrame(np.hstack([raw, np.log1p(raw)]), columns=FEATURE_COLUMNS)
+
+
+def write_npy_header(f, length):
+  """Writes a version 1.0 .npy header for a 1-D float64 array of `length` values, padded to NPY_HEADER_SIZE bytes."""
+  header = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({},), }}".format(length)
+  header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+  f.seek(0)
+  f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+class FeatureStore:
+  """Append-only store of stylometric features, one row per unique text."""
+
+  def __init__(self, path, workers=None, chunk_size=1000):
+    self.path = path
+    self.workers = workers
+    self.chunk_size = chunk_size
+    self.keys_path = os.path.join(path, 'keys.bin')
+    self.column_paths = [os.path.join(path, column + '.npy') for column in FEATURE_COLUMNS]
+    self.columns = None
+    self.rows = {}
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(self.keys_path):
+      with open(self.keys_path, 'rb') as f:
+        data = f.read()
+      # Sliced as raw bytes, a numpy 'S16' array would strip trailing NUL bytes of the hashes
+      self.rows = {data[start:start + 16]: row for row, start in enumerate(range(0, len(data) - 15, 16))}
+      logging.info("Loaded features of {} texts from {}".format(len(self.rows), path))
+    # Drop values written by an interrupted run after their keys were lost
+    for column_path in self.column_paths:
+      with open(column_path, 'ab') as f:
+        f.truncate(NPY_HEADER_SIZE + len(self.rows) * 8)
+      with open(column_path, 'r+b') as f:
+        write_npy_header(f, len(self.rows))
+
+  def __len__(self):
+    return len(self.rows)
+
+  def load_columns(self):
+    """Memory-maps the column files, reopening them after they have grown."""
+    if self.columns is None or len(self.columns[0]) != len(self.rows):
+      self.columns = [np.load(column_path, mmap_mode='r') for column_path in self.column_paths]
+    return self.columns
+
+  def features(self, texts):
+    """Returns a DataFrame with FEATURE_COLUMNS for texts, extracting and appending the ones not stored yet."""
+    texts = ['' if text is None else str(text) for text in texts]
+    keys = [text_key(text) for text in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+      if key not in self.rows and key not in missing:
+        missing[key] = text
+    stage_trace.count("stylometry_store", hits=len(texts) - len(missing), misses=len(missing))
+    if missing:
+      new_values = extract_features(list(missing.values()), self.workers, self.chunk_size).to_numpy()
+      self.add(list(missing), new_values)
+    if not keys:
+      return pd.DataFrame(np.empty((0, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+    rows = np.array([self.rows[key] for key in keys], dtype=np.int64)
+    return pd.DataFrame(np.column_stack([column[rows] for column in self.load_columns()]), columns=FEATURE_COLUMNS)
+
+  def add(self, keys, values):
+    # Values go to disk before their keys so a key always has a full row
+    values = np.asarray(values, dtype=np.float64)
+    length = len(self.rows) + len(keys)
+    for i, column_path in enumerate(self.column_paths):
+      with open(column_path, 'r+b') as f:
+        f.seek(NPY_HEADER_SIZE + len(self.rows) * 8)
+        f.write(np.ascontiguousarray(values[:, i]).tobytes())
+        write_npy_header(f, length)
+    with open(self.keys_path, 'ab') as f:
+      f.write(b''.join(keys))
+    for key in keys:
+      self.rows[key] = len(self.rows)
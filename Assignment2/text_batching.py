@@ -0,0 +1,81 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+"""
+Length-bucketed batching of BERT token ids for the BertBiLSTM model of part1.ipynb.
+
+Texts are tokenized once with padding to a fixed max_length, but each batch
+is only padded to its own longest text: TextDataset returns rows cut to their
+length and the collate function pads them back to the batch maximum.
+LengthBucketSampler groups texts of similar length into the same batch so
+little padding is left.
+"""
+
+
+class TextDataset(Dataset):
+
+  def __init__(self, input_ids, attention_mask, labels):
+    self.input_ids = torch.as_tensor(np.asarray(input_ids), dtype=torch.long)
+    self.attention_mask = torch.as_tensor(np.asarray(attention_mask), dtype=torch.long)
+    self.lengths = self.attention_mask.sum(dim=1)
+    self.labels = torch.as_tensor(np.asarray(labels), dtype=torch.long)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def __getitem__(self, idx):
+    length = int(self.lengths[idx])
+    return {
+      "input_ids": self.input_ids[idx, :length],
+      "attention_mask": self.attention_mask[idx, :length],
+      "labels": self.labels[idx]
+    }
+
+
+def make_pad_collate(pad_token_id=0):
+  """Returns a collate function padding a list of TextDataset rows to the longest one."""
+  def pad_collate(batch):
+    length = max(len(item["input_ids"]) for item in batch)
+    input_ids = torch.full((len(batch), length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+    for row, item in enumerate(batch):
+      input_ids[row, :len(item["input_ids"])] = item["input_ids"]
+      attention_mask[row, :len(item["attention_mask"])] = item["attention_mask"]
+    labels = torch.stack([item["labels"] for item in batch])
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+  return pad_collate
+
+
+class LengthBucketSampler(Sampler):
+  """
+    Yields batches of indices of texts with similar lengths.
+
+    With shuffle, indices are shuffled and cut into buckets of batch_size * bucket_batches,
+    each bucket is sorted by length and cut into batches, and the batches are shuffled.
+    Without shuffle, all indices are sorted by length, so the order is deterministic.
+  """
+
+  def __init__(self, lengths, batch_size, shuffle=True, bucket_batches=50, seed=None):
+    self.lengths = np.asarray(lengths)
+    self.batch_size = batch_size
+    self.shuffle = shuffle
+    self.bucket_size = batch_size * bucket_batches
+    self.rng = np.random.default_rng(seed)
+
+  def __len__(self):
+    return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+  def __iter__(self):
+    if not self.shuffle:
+      order = np.argsort(self.lengths, kind="stable")
+      batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+    else:
+      order = self.rng.permutation(len(self.lengths))
+      batches = []
+      for start in range(0, len(order), self.bucket_size):
+        bucket = order[start:start + self.bucket_size]
+        bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+        batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+      batches = [batches[i] for i in self.rng.permutation(len(batches))]
+    for batch in batches:
+      yield batch.tolist()
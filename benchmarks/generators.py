@@ -0,0 +1,102 @@
+import json
+import string
+
+import numpy as np
+
+"""
+Synthetic data for the benchmarks, in the formats of the real inputs.
+
+Everything is generated from a seed, so a scale always produces the same data.
+Words follow a Zipf-like distribution over a vocabulary of random lowercase
+words mixed with common stopwords, which gives realistic token, bigram and
+vocabulary counts.
+"""
+
+STOPWORDS = ["the", "of", "and", "a", "to", "in", "is", "it", "that", "was", "for", "on", "with", "as", "by"]
+PUNCTUATION = [".", ",", "!", "?", ";", ":", "(", ")", "``", "''", "'s", "--"]
+
+
+def make_vocabulary(size=20000, seed=0):
+    """Returns the stopwords followed by `size` random lowercase words."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_lowercase))
+    lengths = rng.integers(2, 11, size)
+    words = {"".join(rng.choice(letters, length)) for length in lengths}
+    return STOPWORDS + sorted(words - set(STOPWORDS))
+
+
+def sample_words(rng, vocabulary, n, exponent=1.1):
+    """Samples `n` words with probability proportional to 1 / rank**exponent."""
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1) ** exponent
+    indices = rng.choice(len(vocabulary), size=n, p=weights / weights.sum())
+    return np.asarray(vocabulary, dtype=object)[indices]
+
+
+def make_sentences(num_sentences, min_words=5, max_words=25, seed=0, vocabulary=None):
+    """Returns sentences of random words with commas and a final punctuation mark."""
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(seed=seed) if vocabulary is None else vocabulary
+    lengths = rng.integers(min_words, max_words + 1, num_sentences)
+    words = sample_words(rng, vocabulary, int(lengths.sum()))
+    ends = rng.choice([".", "!", "?"], num_sentences, p=[0.9, 0.05, 0.05])
+    sentences = []
+    start = 0
+    for length, end in zip(lengths.tolist(), ends.tolist()):
+        sentence = words[start:start + length].tolist()
+        start += length
+        if length > 8:
+            sentence[length // 2] += ","
+        sentences.append(" ".join(sentence).capitalize() + end)
+    return sentences
+
+
+def make_texts(num_texts, min_sentences=2, max_sentences=10, seed=0):
+    """Returns texts of several sentences, like the SemEval Task 8 documents."""
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(min_sentences, max_sentences + 1, num_texts)
+    sentences = make_sentences(int(counts.sum()), seed=seed)
+    texts = []
+    start = 0
+    for count in counts.tolist():
+        texts.append(" ".join(sentences[start:start + count]))
+        start += count
+    return texts
+
+
+def write_token_file(path, num_tokens, seed=0, chunk_size=1 << 20):
+    """Writes a tokenized corpus with one token per line, like output_nltk.txt."""
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, num_tokens, chunk_size):
+            n = min(chunk_size, num_tokens - start)
+            tokens = sample_words(rng, vocabulary, n)
+            # About one token in eight is punctuation
+            is_punctuation = rng.random(n) < 0.125
+            tokens[is_punctuation] = rng.choice(PUNCTUATION, int(is_punctuation.sum()))
+            f.write("\n".join(tokens.tolist()) + "\n")
+    return path
+
+
+def write_sts_file(path, num_pairs, seed=0):
+    """Writes tab-separated sentence pairs, like the STS2016 input files."""
+    sentences = make_sentences(2 * num_pairs, min_words=4, max_words=20, seed=seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(num_pairs):
+            f.write(f"{sentences[2 * i]}\t{sentences[2 * i + 1]}\n")
+    return path
+
+
+def write_label_files(gold_path, pred_path, num_rows, accuracy=0.7, seed=0):
+    """Writes a gold file with texts in shuffled id order and a prediction file about `accuracy` right."""
+    rng = np.random.default_rng(seed)
+    gold_labels = rng.integers(0, 2, num_rows)
+    pred_labels = np.where(rng.random(num_rows) < accuracy, gold_labels, 1 - gold_labels)
+    text = " ".join(make_sentences(3, seed=seed))
+    with open(gold_path, "w", encoding="utf-8") as f:
+        for i in rng.permutation(num_rows).tolist():
+            f.write(json.dumps({"id": i, "label": int(gold_labels[i]), "text": text, "model": "synthetic"}) + "\n")
+    with open(pred_path, "w", encoding="utf-8") as f:
+        for i, label in enumerate(pred_labels.tolist()):
+            f.write(json.dumps({"id": i, "label": label}) + "\n")
+    return gold_path, pred_path
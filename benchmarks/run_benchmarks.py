@@ -0,0 +1,318 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import generators
+
+"""
+Benchmarks of the corpus, STS and detection hot paths on synthetic data.
+
+Each benchmark runs at one or more scales in a fresh process, so its peak RSS
+is its own. The wall time of the fastest of `--repeat` runs and the matching
+throughput are written to a JSON results file. Given a baseline results file,
+benchmarks whose throughput drops or whose peak memory grows by more than the
+tolerance are reported as regressions and the exit code is 1.
+
+The STS and perplexity benchmarks use tiny randomly initialised BERT and GPT-2
+models built from configs, so no download is needed; they measure the
+pipeline around the model, not the model itself. The stylometry benchmark
+downloads the NLTK punkt tokenizer if needed, and is reported as skipped
+(not failed) when it cannot.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scales small medium --output results.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for module_dir in ["Assignment1/Part_1", "Assignment1/Part_2", "Assignment2"]:
+    sys.path.insert(0, os.path.join(ROOT, module_dir))
+
+# Number of items processed by each benchmark at each scale
+SCALES = {
+    "small": {"corpus": 100_000, "sts": 500, "stylometry": 1_000, "perplexity": 64, "scorer": 10_000},
+    "medium": {"corpus": 1_000_000, "sts": 5_000, "stylometry": 10_000, "perplexity": 512, "scorer": 100_000},
+    "large": {"corpus": 10_000_000, "sts": 50_000, "stylometry": 100_000, "perplexity": 4_096, "scorer": 1_000_000},
+}
+UNITS = {"corpus": "tokens", "sts": "pairs", "stylometry": "texts", "perplexity": "texts", "scorer": "rows"}
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark setup when a requirement is missing; the benchmark is reported as skipped."""
+
+
+def build_tokenizer(vocabulary, model_max_length=128):
+    """Word-level fast tokenizer over the synthetic vocabulary."""
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    special_tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"]
+    vocab = {token: i for i, token in enumerate(special_tokens + [word for word in vocabulary if word not in special_tokens])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]", cls_token="[CLS]", sep_token="[SEP]",
+        model_max_length=model_max_length,
+    )
+
+
+def build_sentence_transformer(model_dir, vocabulary):
+    """Tiny BERT encoder with mean pooling, saved to model_dir and loaded as a SentenceTransformer."""
+    from sentence_transformers import SentenceTransformer
+    from transformers import BertConfig, BertModel
+
+    tokenizer = build_tokenizer(vocabulary)
+    tokenizer.save_pretrained(model_dir)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128, max_position_embeddings=128)
+    BertModel(config).save_pretrained(model_dir)
+    return SentenceTransformer(model_dir, device="cpu")
+
+
+def build_causal_lm(vocabulary):
+    """Tiny GPT-2 language model and its tokenizer."""
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    tokenizer = build_tokenizer(vocabulary)
+    config = GPT2Config(vocab_size=len(tokenizer), n_positions=128, n_embd=64, n_layer=2, n_head=2,
+                        bos_token_id=tokenizer.cls_token_id, eos_token_id=tokenizer.sep_token_id)
+    return GPT2LMHeadModel(config).eval(), tokenizer
+
+
+def corpus_benchmark(size, workdir):
+    from run_analysis import CorpusAnalyzer
+
+    path = generators.write_token_file(os.path.join(workdir, "output_nltk.txt"), size)
+
+    def run():
+        CorpusAnalyzer(path).run_analysis()
+        return size
+    return run
+
+
+def sts_benchmark(size, workdir):
+    from sts_scoring import processing
+
+    model = build_sentence_transformer(os.path.join(workdir, "model"), generators.make_vocabulary())
+    input_file = generators.write_sts_file(os.path.join(workdir, "sts_input.txt"), size)
+    output_file = os.path.join(workdir, "sts_output.txt")
+
+    def run():
+        processing(input_file, output_file, model)
+        return size
+    return run
+
+
+def ensure_punkt():
+    """Downloads the NLTK sentence tokenizer used by avg_sentence_length if it is missing."""
+    import nltk
+
+    # Recent NLTK versions load punkt_tab, older ones punkt
+    for resource_name in ["punkt_tab", "punkt"]:
+        try:
+            nltk.data.find(f"tokenizers/{resource_name}")
+            return
+        except LookupError:
+            if nltk.download(resource_name, quiet=True):
+                return
+    raise SkipBenchmark("the NLTK punkt tokenizer is not installed and could not be downloaded")
+
+
+def stylometry_benchmark(size, workdir):
+    from stylometry import avg_sentence_length, count_punctuation
+
+    ensure_punkt()
+    texts = generators.make_texts(size)
+
+    def run():
+        for text in texts:
+            count_punctuation(text)
+            avg_sentence_length(text)
+        return size
+    return run
+
+
+def perplexity_benchmark(size, workdir):
+    from perplexity import calculate_perplexities
+
+    model, tokenizer = build_causal_lm(generators.make_vocabulary())
+    texts = generators.make_texts(size)
+
+    def run():
+        calculate_perplexities(texts, model, tokenizer, device="cpu", model_name="tiny-gpt2", stride=64)
+        return size
+    return run
+
+
+def scorer_benchmark(size, workdir):
+    from Scorer import evaluate
+
+    gold_path, pred_path = generators.write_label_files(
+        os.path.join(workdir, "gold.jsonl"), os.path.join(workdir, "predictions.jsonl"), size
+    )
+
+    def run():
+        evaluate(pred_path, gold_path)
+        return size
+    return run
+
+
+BENCHMARKS = {
+    "corpus": corpus_benchmark,
+    "sts": sts_benchmark,
+    "stylometry": stylometry_benchmark,
+    "perplexity": perplexity_benchmark,
+    "scorer": scorer_benchmark,
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(name, scale, size, repeat):
+    """Sets up and times one benchmark, in the calling process. Returns its result record."""
+    result = {"benchmark": name, "scale": scale, "unit": UNITS[name], "items": size}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        # Files written by the code under test, such as report.txt, go to workdir
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run = BENCHMARKS[name](size, workdir)
+                result["setup_peak_rss_mb"] = peak_rss_mb()
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    items = run()
+                    times.append(time.perf_counter() - start)
+        except SkipBenchmark as skip:
+            result["skipped"] = str(skip)
+            return result
+        except Exception:
+            result["error"] = traceback.format_exc(limit=3)
+            return result
+        finally:
+            os.chdir(cwd)
+    result["wall_time_s"] = min(times)
+    result["wall_times_s"] = times
+    result["items_per_s"] = items / min(times) if min(times) > 0 else None
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_isolated(name, scale, size, repeat):
+    """Runs a benchmark in a fresh process, so peak RSS and imports are its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_benchmark, name, scale, size, repeat).result()
+
+
+def environment():
+    import numpy as np
+
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    """Prints each result next to its baseline and returns the regressions."""
+    baseline_results = {(r["benchmark"], r["scale"]): r for r in baseline["results"] if "items_per_s" in r}
+    regressions = []
+    print(f"{'benchmark':<12}{'scale':<8}{'items/s':>14}{'baseline':>14}{'ratio':>8}{'peak MB':>10}{'baseline':>10}  status")
+    for result in results:
+        if "items_per_s" not in result:
+            continue
+        reference = baseline_results.get((result["benchmark"], result["scale"]))
+        if reference is None:
+            print(f"{result['benchmark']:<12}{result['scale']:<8}{result['items_per_s']:>14.1f}{'-':>14}{'-':>8}"
+                  f"{result['peak_rss_mb'] or 0:>10.1f}{'-':>10}  new")
+            continue
+        ratio = result["items_per_s"] / reference["items_per_s"]
+        status = []
+        if ratio < 1 - tolerance:
+            status.append("slower")
+        if result["peak_rss_mb"] and reference.get("peak_rss_mb") and \
+                result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + memory_tolerance):
+            status.append("more memory")
+        if status:
+            regressions.append((result, reference, status))
+        print(f"{result['benchmark']:<12}{result['scale']:<8}{result['items_per_s']:>14.1f}{reference['items_per_s']:>14.1f}"
+              f"{ratio:>8.2f}{result['peak_rss_mb'] or 0:>10.1f}{reference.get('peak_rss_mb') or 0:>10.1f}  "
+              f"{', '.join(status) or 'ok'}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the corpus, STS and detection hot paths.")
+    parser.add_argument("--benchmarks", "-b", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks to run.")
+    parser.add_argument("--scales", "-s", nargs="+", choices=list(SCALES), default=["small"], help="Scales to run.")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="Timed runs per benchmark, the fastest is kept.")
+    parser.add_argument("--output", "-o", default="benchmark_results.json", help="JSON results file.")
+    parser.add_argument("--baseline", default=None, help="Results file to compare against.")
+    parser.add_argument("--save-baseline", default=None, help="Also write the results to this baseline file.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative drop of items/s before a benchmark counts as a regression.")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2,
+                        help="Allowed relative growth of peak RSS before a benchmark counts as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        for name in args.benchmarks:
+            size = SCALES[scale][name]
+            print(f"Running {name} ({scale}, {size:,d} {UNITS[name]})...", flush=True)
+            result = run_isolated(name, scale, size, args.repeat)
+            if "error" in result:
+                print(f"  failed:\n{result['error']}")
+            elif "skipped" in result:
+                print(f"  skipped: {result['skipped']}")
+            else:
+                print(f"  {result['wall_time_s']:.3f}s, {result['items_per_s']:,.1f} {UNITS[name]}/s, "
+                      f"peak RSS {result['peak_rss_mb'] or 0:.1f} MB")
+            results.append(result)
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    failed = [result for result in results if "error" in result]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.memory_tolerance)
+        for result, reference, status in regressions:
+            print(f"Regression in {result['benchmark']} ({result['scale']}): {', '.join(status)}")
+    if failed or regressions:
+        sys.exit(1)
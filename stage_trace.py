@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+"""
+Opt-in stage timing for the corpus, STS and detection pipelines.
+
+Code marks its stages with
+
+    with stage_trace.stage("encode", items=len(sentences)) as s:
+        ...
+        s.items = n  # if the count is only known at the end
+
+and can record counters with stage_trace.count("cache", hits=h, misses=m).
+
+Tracing is off unless the STAGE_TRACE environment variable names an output
+file, or a script calls enable() (for instance from a --trace flag). When it
+is off, stage() returns a shared no-op context manager, so an instrumented
+stage costs one function call.
+
+When it is on, each stage becomes a Chrome trace "complete" event with its
+start, duration, item count, items/s and the process' current and peak RSS.
+A path ending in .json is written in the Chrome trace array format (open it in
+chrome://tracing or Perfetto); any other path gets one JSON event per line.
+Worker processes inherit the environment variable and append to the same
+file, with their own pid.
+"""
+
+ENV_VAR = "STAGE_TRACE"
+# Pid of the process that started the trace file, so worker processes append instead of truncating it
+OWNER_ENV_VAR = "STAGE_TRACE_OWNER"
+
+
+class NullStage:
+    """Stage returned when tracing is off. Setting attributes on it does nothing."""
+
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+def memory_snapshot():
+    """Current and peak resident set size of the process, in MB."""
+    snapshot = {}
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            snapshot["rss_mb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        snapshot["peak_rss_mb"] = peak / (1 << 20) if os.uname().sysname == "Darwin" else peak / 1024
+    return snapshot
+
+
+class Stage:
+    __slots__ = ("tracer", "name", "items", "args", "ts", "start")
+
+    def __init__(self, tracer, name, items, args):
+        self.tracer = tracer
+        self.name = name
+        self.items = items
+        self.args = args
+
+    def __enter__(self):
+        self.ts = time.time_ns() // 1000
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        args = dict(self.args)
+        if self.items is not None:
+            args["items"] = self.items
+            args["items_per_s"] = self.items / duration if duration > 0 else None
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        args.update(memory_snapshot())
+        self.tracer.write({
+            "name": self.name, "cat": "stage", "ph": "X", "ts": self.ts, "dur": duration * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": args,
+        })
+        return False
+
+
+class Tracer:
+
+    def __init__(self):
+        self.path = None
+        self.chrome = False
+        self.file = None
+        self.file_pid = None
+        self.lock = threading.Lock()
+
+    def enable(self, path):
+        """Starts writing events to path. The process that starts a trace truncates the file."""
+        path = os.path.abspath(path)
+        self.path = path
+        self.chrome = path.endswith(".json")
+        os.environ[ENV_VAR] = path
+        owner = os.environ.get(OWNER_ENV_VAR)
+        if owner is None or owner == str(os.getpid()):
+            os.environ[OWNER_ENV_VAR] = str(os.getpid())
+            with open(path, "w", encoding="utf-8") as f:
+                # The closing bracket is optional in the Chrome trace format
+                f.write("[\n" if self.chrome else "")
+
+    def disable(self):
+        with self.lock:
+            if self.file is not None and self.file_pid == os.getpid():
+                self.file.close()
+            self.path = None
+            self.file = None
+
+    def write(self, event):
+        line = json.dumps(event) + (",\n" if self.chrome else "\n")
+        with self.lock:
+            if self.path is None:
+                return
+            # A forked worker opens its own handle instead of sharing the parent's
+            if self.file is None or self.file_pid != os.getpid():
+                self.file = open(self.path, "a", encoding="utf-8")
+                self.file_pid = os.getpid()
+            self.file.write(line)
+            self.file.flush()
+
+
+tracer = Tracer()
+
+
+def enable(path):
+    tracer.enable(path)
+
+
+def disable():
+    tracer.disable()
+
+
+def enabled():
+    return tracer.path is not None
+
+
+def stage(name, items=None, **args):
+    """Times a block of code as one stage. Returns a no-op context manager when tracing is off."""
+    if tracer.path is None:
+        return NULL_STAGE
+    return Stage(tracer, name, items, args)
+
+
+def count(name, **values):
+    """Records counter values, shown as a Chrome trace counter track."""
+    if tracer.path is None:
+        return
+    tracer.write({
+        "name": name, "cat": "counter", "ph": "C", "ts": time.time_ns() // 1000,
+        "pid": os.getpid(), "tid": threading.get_ident(), "args": values,
+    })
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])